@@ -1,3 +1,9 @@
+import gc
+import os
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
 import pmock
@@ -287,6 +293,228 @@ class MockMultipleMethodsTest(unittest.TestCase):
             pass
 
 
+class MockMixedMatchersLifoTest(unittest.TestCase):
+
+    def test_custom_matcher_defined_later_takes_precedence(self):
+        class AnyInvocationMatcher:
+            def matches(self, invocation): return True
+            def invoked(self, invocation): pass
+            def verify(self): pass
+        mock = pmock.Mock()
+        mock.stubs().method("cat").will(pmock.return_value("named"))
+        mock.stubs().match(AnyInvocationMatcher()).will(
+            pmock.return_value("custom"))
+        self.assertEqual(mock.cat(), "custom")
+
+    def test_named_defined_later_takes_precedence(self):
+        class AnyInvocationMatcher:
+            def matches(self, invocation): return True
+            def invoked(self, invocation): pass
+            def verify(self): pass
+        mock = pmock.Mock()
+        mock.stubs().match(AnyInvocationMatcher()).will(
+            pmock.return_value("custom"))
+        mock.stubs().method("cat").will(pmock.return_value("named"))
+        self.assertEqual(mock.cat(), "named")
+        self.assertEqual(mock.dog(), "custom")
+
+
+class MockEqArgumentsLookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = pmock.Mock()
+        for i in range(100):
+            self.mock.stubs().method("get").taking(pmock.eq(i)).will(
+                pmock.return_value(str(i)))
+
+    def test_lookup(self):
+        self.assertEqual(self.mock.get(42), "42")
+        self.assertEqual(self.mock.get(42.0), "42")
+        try:
+            self.mock.get(100)
+            self.fail()
+        except pmock.MatchError:
+            pass
+
+    def test_later_non_eq_expectation_takes_precedence(self):
+        self.mock.stubs().method("get").taking(
+            pmock.functor(lambda arg: arg > 50)).will(
+            pmock.return_value("big"))
+        self.assertEqual(self.mock.get(42), "42")
+        self.assertEqual(self.mock.get(60), "big")
+
+    def test_argument_equal_to_expected_value(self):
+        class Answer:
+            def __eq__(self, other): return other == 42
+        self.assertEqual(self.mock.get(Answer()), "42")
+
+    def test_once_keyed_expectation(self):
+        self.mock.expects(pmock.once()).get(pmock.eq(7)).will(
+            pmock.return_value("seven"))
+        self.assertEqual(self.mock.get(7), "seven")
+        self.assertEqual(self.mock.get(7), "7")
+        self.mock.verify()
+
+
+class FrozenMockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = pmock.Mock()
+        self.mock.expects(pmock.once()).method("dog").taking(
+            pmock.eq("bone")).will(pmock.return_value("woof")).id("bone")
+        self.mock.expects(pmock.at_least_once()).method("cat").after("bone")
+        self.mock.expects(pmock.never()).method("mouse")
+        self.mock.stubs().method("dog").taking_at_least(
+            pmock.string_contains("ball"))
+        self.mock.freeze()
+
+    def test_called_as_expected(self):
+        self.assertEqual(self.mock.dog("bone"), "woof")
+        self.mock.dog("blue ball", "red ball")
+        self.mock.cat()
+        self.mock.cat()
+        self.mock.verify()
+
+    def test_uncalled(self):
+        self.assertRaises(pmock.VerificationError, self.mock.verify)
+
+    def test_call_out_of_order(self):
+        self.assertRaises(pmock.MatchError, self.mock.cat)
+
+    def test_call_once_twice(self):
+        self.mock.dog("bone")
+        self.assertRaises(pmock.MatchError, self.mock.dog, "bone")
+
+    def test_call_never(self):
+        self.assertRaises(pmock.MatchError, self.mock.mouse)
+
+    def test_define_expectation(self):
+        self.assertRaises(pmock.DefinitionError, self.mock.expects,
+                          pmock.once())
+
+    def test_define_order_after_frozen_mock(self):
+        other_mock = pmock.Mock()
+        builder = other_mock.expects(pmock.once()).method("rat")
+        self.assertRaises(pmock.DefinitionError, builder.after, "bone",
+                          self.mock)
+
+
+class CountedCallsTest(unittest.TestCase):
+
+    def test_exactly(self):
+        mock = pmock.Mock()
+        mock.expects(pmock.exactly(1000)).method("tick").will(
+            pmock.return_value("tock"))
+        for i in xrange(1000):
+            self.assertEqual(mock.tick(), "tock")
+        mock.verify()
+        try:
+            mock.tick()
+            self.fail("expected overrun to raise")
+        except pmock.MatchError, err:
+            self.assert_(err.msg.startswith("no match found"))
+            self.assert_(err.msg.find("expected exactly 1000 times and has "
+                                      "been invoked 1000 times") != -1)
+
+    def test_too_few(self):
+        mock = pmock.Mock()
+        mock.expects(pmock.between(2, 3)).method("tick")
+        mock.tick()
+        try:
+            mock.verify()
+            self.fail("expected verify to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(err.msg,
+                             "expected method to be invoked between 2 and "
+                             "3 times but was invoked 1 time: expected "
+                             "between 2 and 3 times and has been invoked "
+                             "1 time: tick")
+
+    def test_overrun_falls_back_to_earlier_expectation(self):
+        mock = pmock.Mock()
+        mock.stubs().method("tick").will(pmock.return_value("stub"))
+        mock.expects(pmock.at_most(2)).method("tick").will(
+            pmock.return_value("counted"))
+        self.assertEqual(mock.tick(), "counted")
+        self.assertEqual(mock.tick(), "counted")
+        self.assertEqual(mock.tick(), "stub")
+        mock.verify()
+
+
+class FifoDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = pmock.Mock(dispatcher=pmock.FifoDispatcher())
+        self.mock.stubs().method("ping").will(pmock.return_value("pong"))
+        self.mock.expects(pmock.once()).method("send").taking(
+            pmock.eq("HELO")).will(pmock.return_value(250))
+        self.mock.expects(pmock.at_least_once()).method("send").taking(
+            pmock.string_contains("RCPT"))
+        self.mock.expects(pmock.once()).method("send").taking(
+            pmock.eq("QUIT")).will(pmock.return_value(221))
+
+    def test_script(self):
+        self.assertEqual(self.mock.send("HELO"), 250)
+        self.assertEqual(self.mock.ping(), "pong")
+        self.mock.send("RCPT TO:<a>")
+        self.mock.send("RCPT TO:<b>")
+        self.assertEqual(self.mock.send("QUIT"), 221)
+        self.mock.verify()
+
+    def test_out_of_order(self):
+        self.assertRaises(pmock.MatchError, self.mock.send, "QUIT")
+
+    def test_verify_reports_earliest_unsatisfied(self):
+        self.mock.send("HELO")
+        try:
+            self.mock.verify()
+            self.fail("expected verify to raise")
+        except pmock.VerificationError, err:
+            self.assert_(err.msg.find("expected at least once") != -1)
+
+    def test_long_script(self):
+        mock = pmock.Mock(dispatcher=pmock.FifoDispatcher())
+        for i in xrange(2000):
+            mock.expects(pmock.once()).method("step").taking(pmock.eq(i))
+        for i in xrange(2000):
+            mock.step(i)
+        mock.verify()
+
+
+class SatisfactionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mock = pmock.Mock()
+        self.mock.expects(pmock.once()).method("bat")
+        self.mock.expects(pmock.at_least_once()).method("owl")
+        self.mock.stubs().method("moth")
+
+    def test_satisfied_as_expectations_are_met(self):
+        self.assert_(not self.mock.is_satisfied())
+        self.mock.bat()
+        self.mock.moth()
+        self.assert_(not self.mock.is_satisfied())
+        self.mock.owl()
+        self.assert_(self.mock.is_satisfied())
+        self.mock.verify()
+
+    def test_verify_reports_last_unsatisfied_expectation(self):
+        self.mock.owl()
+        try:
+            self.mock.verify()
+            self.fail("expected verify to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(
+                err.msg,
+                "expected method was not invoked: expected once: bat")
+
+    def test_frozen_mock_satisfaction(self):
+        self.mock.freeze()
+        self.mock.bat()
+        self.mock.owl()
+        self.assert_(self.mock.is_satisfied())
+
+
 class SpecialMethodsTest(pmock.MockTestCase):
 
     def test_expected_specials(self):
@@ -365,6 +593,24 @@ class OnceTest(unittest.TestCase):
             pass
 
 
+class OnceScriptTest(unittest.TestCase):
+
+    def test_many_once_expectations(self):
+        mock = pmock.Mock()
+        for i in range(100):
+            mock.expects(pmock.once()).method("rabbit").will(
+                pmock.return_value(i))
+        results = [mock.rabbit() for i in range(100)]
+        self.assertEqual(results, range(99, -1, -1))
+        mock.verify()
+        try:
+            mock.rabbit()
+            self.fail()
+        except pmock.MatchError, err:
+            self.assert_(err.msg.find("expected once and has been invoked: "
+                                      "rabbit, returns 0") != -1)
+
+
 class AtLeastOnceTest(unittest.TestCase):
 
     def setUp(self):
@@ -449,6 +695,338 @@ class OrderedCallsAcrossMocksTest(unittest.TestCase):
             pass
 
 
+class OrderedWorkflowTest(unittest.TestCase):
+
+    def setUp(self):
+        self.barn = pmock.Mock("barn")
+        self.field = pmock.Mock("field")
+        self.barn.expects(pmock.once()).method("milk")
+        self.barn.expects(pmock.once()).method("feed")
+        self.field.expects(pmock.once()).method("plough")
+        self.field.expects(pmock.once()).method("sow").after(
+            "milk", self.barn).after("feed", self.barn).after("plough")
+        self.barn.expects(pmock.at_least_once()).method("rest").after(
+            "sow", self.field)
+
+    def test_call_in_order(self):
+        self.field.plough()
+        self.barn.feed()
+        self.barn.milk()
+        self.field.sow()
+        self.barn.rest()
+        self.barn.rest()
+        self.barn.verify()
+        self.field.verify()
+
+    def test_call_before_all_predecessors_doesnt_match(self):
+        self.barn.milk()
+        self.field.plough()
+        try:
+            self.field.sow()
+            self.fail("expected sow to raise")
+        except pmock.MatchError, err:
+            self.assert_(err.msg.find(
+                "sow.after('milk' on mock 'barn').after('feed' on mock "
+                "'barn').after('plough')") != -1)
+        self.assertRaises(pmock.MatchError, self.barn.rest)
+
+
+class OrderAssertionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.barn = pmock.Mock("barn")
+        self.field = pmock.Mock("field")
+        self.milk = self.barn.expects(pmock.at_least_once()).method("milk")
+        self.plough = self.field.expects(pmock.once()).method("plough")
+        self.rest = self.barn.expects(pmock.once()).method("rest")
+
+    def test_in_order(self):
+        self.barn.milk()
+        self.barn.milk()
+        self.field.plough()
+        self.barn.rest()
+        pmock.assert_in_order(self.milk, self.plough, self.rest)
+        pmock.assert_before(self.milk, self.rest)
+        pmock.assert_between(self.milk, self.plough,
+                             self.barn.lookup_id("rest"))
+
+    def test_out_of_order(self):
+        self.barn.milk()
+        self.field.plough()
+        self.barn.milk()
+        try:
+            pmock.assert_before(self.milk, self.plough)
+            self.fail("expected assert_before to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(
+                err.msg,
+                "invoked out of order\n"
+                "expected at least once and has been invoked: milk\n"
+                "was expected before\n"
+                "expected once and has been invoked: plough")
+
+    def test_not_invoked(self):
+        self.barn.milk()
+        try:
+            pmock.assert_before(self.milk, self.plough)
+            self.fail("expected assert_before to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(err.msg, "expected method was not invoked: "
+                             "expected once: plough")
+
+
+class ThreadSafeMockTest(unittest.TestCase):
+
+    def _call_from_threads(self, thread_count, function):
+        results = []
+        start = threading.Event()
+        def call():
+            start.wait()
+            try:
+                results.append(function())
+            except pmock.MatchError, err:
+                results.append(err)
+        threads = [threading.Thread(target=call)
+                   for i in range(thread_count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_once_invoked_by_only_one_thread(self):
+        self.mock = pmock.ThreadSafeMock()
+        self.mock.expects(pmock.once()).fetch().will(
+            pmock.return_value("job"))
+        results = self._call_from_threads(8, self.mock.fetch)
+        self.assertEqual(results.count("job"), 1)
+        self.assertEqual(
+            len([r for r in results if isinstance(r, pmock.MatchError)]), 7)
+        self.mock.verify()
+
+    def test_counted_calls_from_many_threads(self):
+        self.mock = pmock.ThreadSafeMock()
+        self.mock.expects(pmock.exactly(800)).fetch()
+        def fetch_repeatedly():
+            for i in range(100):
+                self.mock.fetch()
+        results = self._call_from_threads(8, fetch_repeatedly)
+        self.assertEqual(results, [None] * 8)
+        self.mock.verify()
+        self.assertRaises(pmock.MatchError, self.mock.fetch)
+
+    def test_once_expectations_used_up_from_many_threads(self):
+        for dispatcher in [pmock.InvokableIndex(), pmock.FifoDispatcher()]:
+            self.mock = pmock.ThreadSafeMock(dispatcher=dispatcher)
+            for i in range(800):
+                self.mock.expects(pmock.once()).fetch().will(
+                    pmock.return_value(i))
+            def fetch_repeatedly():
+                return [self.mock.fetch() for i in range(100)]
+            results = self._call_from_threads(8, fetch_repeatedly)
+            fetched = []
+            for result in results:
+                fetched.extend(result)
+            fetched.sort()
+            self.assertEqual(fetched, range(800))
+            self.mock.verify()
+            self.assertRaises(pmock.MatchError, self.mock.fetch)
+
+    def test_wait_for_worker_thread(self):
+        self.mock = pmock.ThreadSafeMock()
+        self.mock.expects(pmock.once()).fetch().will(
+            pmock.return_value("job"))
+        done = self.mock.expects(pmock.once()).done().after("fetch")
+        def work():
+            self.mock.fetch()
+            self.mock.done()
+        worker = threading.Thread(target=work)
+        worker.start()
+        self.mock.wait_until_invoked(done, 10)
+        self.mock.wait_until_satisfied(10)
+        worker.join()
+
+    def test_stubs_run_concurrently(self):
+        arrived = threading.Condition()
+        arrivals = []
+        class RendezvousStub(object):
+            def invoke(self, invocation):
+                arrived.acquire()
+                try:
+                    arrivals.append(invocation)
+                    arrived.notifyAll()
+                    while len(arrivals) < 2:
+                        arrived.wait(5)
+                    return len(arrivals)
+                finally:
+                    arrived.release()
+        self.mock = pmock.ThreadSafeMock()
+        self.mock.stubs().meet().will(RendezvousStub())
+        self.assertEqual(self._call_from_threads(2, self.mock.meet), [2, 2])
+
+
+class DelayStubTest(unittest.TestCase):
+
+    def _fetch_with_retries(self, service, clock, timeout):
+        backoff = 1
+        while True:
+            start = clock.time()
+            result = service.fetch()
+            if clock.time() - start <= timeout:
+                return result
+            clock.sleep(backoff)
+            backoff *= 2
+
+    def test_timed_out_calls_retried_with_backoff(self):
+        clock = pmock.VirtualClock()
+        service = pmock.Mock()
+        service.expects(pmock.once()).fetch().will(
+            pmock.delay(3, pmock.return_value("slow"), clock)).id("slow")
+        service.expects(pmock.once()).fetch().will(
+            pmock.delay(0.5, pmock.return_value("fast"), clock)).after(
+            "slow")
+        self.assertEqual(self._fetch_with_retries(service, clock, 1),
+                         "fast")
+        self.assertEqual(clock.time(), 4.5)
+        service.verify()
+
+    def test_installed_clock(self):
+        clock = pmock.virtual_clock()
+        clock.install()
+        try:
+            service = pmock.Mock()
+            service.stubs().fetch().will(pmock.delay(10))
+            start = time.time()
+            service.fetch()
+            self.assertEqual(time.time() - start, 10)
+        finally:
+            clock.uninstall()
+
+
+class LoadedExpectationsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _write(self, file_name, text):
+        path = os.path.join(self.directory, file_name)
+        recording = open(path, "w")
+        recording.write(text)
+        recording.close()
+        return path
+
+    def test_recorded_session(self):
+        path = self._write("session.jsonl",
+                           '{"method": "connect", "args": ["db"], '
+                           '"count": 1}\n'
+                           '{"method": "query", "args": ["users"], '
+                           '"returns": [["ann"], ["bob"]], "count": 1}\n'
+                           '{"method": "query", "args": ["groups"], '
+                           '"raises": "KeyError: groups"}\n')
+        mock = pmock.Mock()
+        self.assertEqual(pmock.load_expectations(mock, path), 3)
+        mock.expects(pmock.once()).close().after("query")
+        mock.connect("db")
+        self.assertEqual(mock.query("users"), [["ann"], ["bob"]])
+        self.assertRaises(KeyError, mock.query, "groups")
+        mock.close()
+        mock.verify()
+
+    def test_unsatisfied_loaded_expectation(self):
+        path = self._write("calls.csv", "method,args,count\n"
+                                        'fetch,"[1]",2\n')
+        mock = pmock.Mock()
+        pmock.load_expectations(mock, path)
+        mock.fetch(1)
+        try:
+            mock.verify()
+            self.fail("expected verify to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(err.msg,
+                             "expected method to be invoked exactly 2 times "
+                             "but was invoked 1 time: expected exactly 2 "
+                             "times and has been invoked 1 time: "
+                             "fetch(pmock.eq(1))")
+
+
+class InvocationLogTest(pmock.MockTestCase):
+
+    def test_query_logged_calls(self):
+        log = pmock.InvocationLog()
+        stream = self.mock(invocation_log=log)
+        stream.stubs().method("write")
+        stream.stubs().method("flush")
+        for size in (100, 5000, 4096, 8192):
+            stream.write("x" * size)
+            stream.flush()
+        large_writes = log.select("write", pmock.functor(lambda data:
+                                                         len(data) > 4096))
+        self.assertEqual([len(call.args[0]) for call in large_writes],
+                         [5000, 8192])
+        self.assertEqual(log.count("flush"), 4)
+        self.assert_(large_writes[0].sequence < large_writes[1].sequence)
+
+    def test_match_error_reports_recent_calls(self):
+        log = pmock.InvocationLog(capacity=100, report_count=2)
+        stream = pmock.Mock(invocation_log=log)
+        stream.stubs().method("write")
+        for data in ("a", "b", "c"):
+            stream.write(data)
+        try:
+            stream.close()
+            self.fail("expected close to raise")
+        except pmock.MatchError, err:
+            self.assertEqual(err.msg,
+                             "no match found\n"
+                             "invoked close()\n"
+                             "in:\n"
+                             "stub: write\n"
+                             "recent invocations:\n"
+                             "write('c')\n"
+                             "close()")
+
+    def test_weak_references_dont_keep_arguments_alive(self):
+        class Frame(object):
+            def __init__(self, size): self.size = size
+        log = pmock.InvocationLog(capture=pmock.WeakReferenceCapture())
+        sink = pmock.Mock(invocation_log=log)
+        sink.stubs().method("send")
+        kept = Frame(10)
+        sink.send(kept)
+        sink.send(Frame(20))
+        gc.collect()
+        self.assertEqual([str(call) for call in log.select()][1],
+                         "send(<collected Frame>)")
+        self.assert_(log.select()[0].args[0] is kept)
+        self.assertEqual(len(log.select("send", pmock.functor(
+            lambda frame: getattr(frame, "size", 0) == 10))), 1)
+
+    def test_fingerprints_match_equal_arguments(self):
+        log = pmock.InvocationLog(capture=pmock.FingerprintCapture())
+        stream = pmock.Mock(invocation_log=log)
+        stream.stubs().method("write")
+        stream.write("x" * 100000, 0)
+        stream.write("y" * 100000, 100000)
+        self.assertEqual(
+            [call.args[1] for call in log.select("write",
+                                                 pmock.eq("y" * 100000))],
+            [100000])
+
+    def test_bounded_log_counts_every_call(self):
+        log = pmock.InvocationLog(capacity=50, sample_every=10)
+        stream = pmock.Mock(invocation_log=log)
+        stream.stubs().method("write")
+        for i in xrange(10000):
+            stream.write(i)
+        self.assertEqual(log.count("write"), 10000)
+        self.assertEqual(len(log), 50)
+        self.assertEqual(log.select()[-1].args, (9990,))
+
+
 class OrderedCallsAdditionalTest(testsupport.ErrorMsgAssertsMixin,
                                  unittest.TestCase):
 
@@ -525,6 +1103,48 @@ class StubTest(unittest.TestCase):
         mock.set_default_stub(pmock.return_value("trot"))
         self.assertEqual(mock.fox(), "trot")
 
+    def test_from_table(self):
+        mock = pmock.Mock()
+        mock.stubs().method("sound").will(pmock.return_value("silence"))
+        mock.stubs().method("sound").from_table({"fox": "yelp",
+                                                 ("fox", "cub"): "squeal"})
+        self.assertEqual(mock.sound("fox"), "yelp")
+        self.assertEqual(mock.sound("fox", "cub"), "squeal")
+        self.assertEqual(mock.sound("hen"), "silence")
+        self.assertEqual(mock.sound(("fox", "cub")), "silence")
+        mock.verify()
+
+    def test_from_table_after_arguments(self):
+        mock = pmock.Mock()
+        try:
+            mock.stubs().sound().from_table({"fox": "yelp"})
+            self.fail("expected from_table after arguments to raise")
+        except pmock.DefinitionError, err:
+            self.assertEqual(err.msg, "arguments of expectation stub: "
+                             "sound() are already defined")
+        mock.stubs().sound.from_table({"fox": "yelp"})
+        self.assertEqual(mock.sound("fox"), "yelp")
+
+    def test_lookup_with_default(self):
+        mock = pmock.Mock()
+        mock.stubs().method("sound").will(
+            pmock.lookup({"fox": "yelp"}, default="silence"))
+        self.assertEqual(mock.sound("fox"), "yelp")
+        self.assertEqual(mock.sound("hen"), "silence")
+
+    def test_lookup_without_entry(self):
+        mock = pmock.Mock()
+        mock.stubs().method("sound").will(pmock.lookup({"fox": "yelp"}))
+        try:
+            mock.sound("hen")
+            self.fail("expected a missing table entry to raise")
+        except pmock.MatchError, err:
+            self.assertEqual(err.msg,
+                             "no table entry for arguments\n"
+                             "invoked sound('hen')\n"
+                             "in:\n"
+                             "stub: sound, looks up table of 1 entry")
+
 
 class ErrorMessageTest(unittest.TestCase):
 
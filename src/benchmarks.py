@@ -0,0 +1,851 @@
+"""Benchmarks of the pmock mock engine.
+
+Run directly to print the results, optionally saving them as JSON::
+
+    python benchmarks.py [--repeat N] [--json FILE] [NAME_SUBSTRING ...]
+
+A saved JSON file can be used as a baseline for a later run, which then
+reports the change in each benchmark's median and exits with a non-zero
+status if any got slower or bigger by more than the threshold::
+
+    python benchmarks.py --json baseline.json
+    python benchmarks.py --compare baseline.json [--threshold PERCENT]
+
+Each timing benchmark creates its function afresh for every repetition, so
+expectations used up by one repetition don't affect the next. Unless a
+benchmark fixes how many times its function is called in a repetition, as
+those using up expectations do, the number is calibrated first, like
+timeit's autorange, so that a repetition takes at least 10 ms and the
+cost of the function's first call is spread over many. The first
+repetition is a discarded warm up, and the garbage collector is disabled
+while timing. The minimum, median, mean and standard deviation of the time
+per operation are reported across the remaining repetitions.
+
+Allocation benchmarks count the objects tracked by the garbage collector
+that each call leaves allocated, and size benchmarks the bytes an object
+holds.
+"""
+
+import __builtin__
+import gc
+import json
+import math
+import optparse
+import platform
+import StringIO
+import sys
+import threading
+import time
+import timeit
+import types
+import unittest
+
+import pmock
+
+
+##############################################################################
+# Measurement
+##############################################################################
+
+class TimingBenchmark(object):
+    """Time per operation of a function.
+
+    @param create_function: called before each repetition to get a fresh
+    function performing the given number of operations.
+    @param number: calls of the function timed in each repetition, or None
+    to calibrate it.
+    """
+
+    unit = "usec"
+
+    # shortest time a calibrated repetition runs for
+    min_seconds = 0.01
+
+    def __init__(self, name, create_function, operations=1, number=None):
+        self.name = name
+        self._create_function = create_function
+        self._operations = operations
+        self._number = number
+
+    def _calibrate(self):
+        """Fewest calls in 1, 2, 5, 10, 20, ... taking at least
+        min_seconds."""
+        timer = timeit.Timer(self._create_function())
+        number = 1
+        while True:
+            for multiple in (1, 2, 5):
+                if timer.timeit(number * multiple) >= self.min_seconds:
+                    return number * multiple
+            number *= 10
+
+    def run(self, repeat):
+        number = self._number
+        if number is None:
+            number = self._calibrate()
+        samples = []
+        for i in range(repeat + 1):
+            timer = timeit.Timer(self._create_function())
+            seconds = timer.timeit(number)
+            samples.append(seconds * 1e6 / (number * self._operations))
+        return samples[1:]
+
+
+class AllocationBenchmark(object):
+    """Objects left allocated by each call of a function, from the change
+    in the garbage collector's count of its youngest generation.
+
+    Python 2 has no tracemalloc, and the count goes down again as tracked
+    objects are freed, so this shows the containers calls keep, not their
+    short-lived ones. The function is called once before counting, so
+    caches it fills don't count, and the count for number calls is taken
+    off that for twice as many, so a constant offset from counting itself
+    doesn't either.
+
+    @param create_function: called before each repetition to get a fresh
+    function.
+    @param number: calls of the function counted in each repetition.
+    """
+
+    unit = "objects"
+
+    def __init__(self, name, create_function, number=1000):
+        self.name = name
+        self._create_function = create_function
+        self._number = number
+
+    def _count(self, function, number):
+        gc_was_enabled = gc.isenabled()
+        gc.collect()
+        gc.disable()
+        try:
+            count = gc.get_count()[0]
+            for i in xrange(number):
+                function()
+            return gc.get_count()[0] - count
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    def run(self, repeat):
+        samples = []
+        for i in range(repeat):
+            function = self._create_function()
+            function()
+            number = self._number
+            count = (self._count(function, 2 * number) -
+                     self._count(function, number))
+            samples.append(float(count) / number)
+        return samples
+
+
+class SizeBenchmark(object):
+    """Memory held by an object, which doesn't vary between runs."""
+
+    unit = "bytes"
+
+    def __init__(self, name, measure):
+        self.name = name
+        self._measure = measure
+
+    def run(self, repeat):
+        return [float(self._measure())]
+
+
+def summarise(samples):
+    ordered = sorted(samples)
+    count = len(ordered)
+    middle = count // 2
+    if count % 2:
+        median = ordered[middle]
+    else:
+        median = (ordered[middle - 1] + ordered[middle]) / 2.0
+    mean = sum(ordered) / count
+    if count > 1:
+        variance = sum([(x - mean) ** 2 for x in ordered]) / (count - 1)
+    else:
+        variance = 0.0
+    return {"min": ordered[0],
+            "median": median,
+            "mean": mean,
+            "stdev": math.sqrt(variance),
+            "samples": count}
+
+
+_SHARED_TYPES = (type, types.ClassType, types.ModuleType,
+                 types.BuiltinFunctionType, types.CodeType)
+
+
+def _size_in_bytes(obj, excluded=()):
+    """Memory held by the object and everything it refers to, other than
+    classes, modules, code and the excluded objects."""
+    seen = set([id(excluded_obj) for excluded_obj in excluded])
+    seen.add(id(__builtin__.__dict__))
+    size = 0
+    pending = [obj]
+    while pending:
+        referent = pending.pop()
+        if id(referent) in seen or isinstance(referent, _SHARED_TYPES):
+            continue
+        seen.add(id(referent))
+        size += sys.getsizeof(referent)
+        pending.extend(gc.get_referents(referent))
+    return size
+
+
+##############################################################################
+# Definition
+##############################################################################
+
+def define_expectations(count):
+    """Define expectations with eq() arguments and a stub."""
+    def define():
+        mock = pmock.Mock()
+        for i in xrange(count):
+            mock.expects(pmock.once()).method("lookup").taking(
+                pmock.eq(i)).will(pmock.return_value(i))
+    return define
+
+
+def define_table(count):
+    """Define a stub for every key of a table at once."""
+    table = dict([(i, i) for i in xrange(count)])
+    def define():
+        mock = pmock.Mock()
+        mock.stubs().method("lookup").from_table(table)
+    return define
+
+
+def _recorded_rows(count, format):
+    if format == "csv":
+        lines = ["method,args,returns,count"]
+        for i in xrange(count):
+            lines.append('lookup,"[%d]",%d,1' % (i, i))
+    else:
+        lines = ['{"method": "lookup", "args": [%d], "returns": %d, '
+                 '"count": 1}' % (i, i) for i in xrange(count)]
+    return "\n".join(lines)
+
+
+def load_expectations(count, format):
+    """Load expectations with arguments and a return value, one per row,
+    from a file in memory."""
+    text = _recorded_rows(count, format)
+    def load():
+        pmock.load_expectations(pmock.Mock(), StringIO.StringIO(text),
+                                format)
+    return load
+
+
+##############################################################################
+# Invocation
+##############################################################################
+
+def invoke_first_match(count):
+    """Call a method whose most recently defined stub matches.
+
+    The cost per call shouldn't grow with the number of stubs, as the
+    dispatch walks the stubs in place rather than copying them.
+    """
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("lookup").will(pmock.return_value(i))
+    return mock.lookup
+
+
+def invoke_eq_lookup(count):
+    """Call a method with eq() stubs for many different arguments; the
+    stub for the first value has to be found among all the others."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("lookup").taking(pmock.eq(i)).will(
+            pmock.return_value(i))
+    return lambda: mock.lookup(0)
+
+
+def invoke_table_lookup(count):
+    """Call a method stubbed from a table, with the first key of many."""
+    mock = pmock.Mock()
+    mock.stubs().method("lookup").from_table(
+        dict([(i, i) for i in xrange(count)]))
+    return lambda: mock.lookup(0)
+
+
+def invoke_scan(count):
+    """Call a method whose stub is the first of many with non-eq()
+    constraints, so every stub has to be tried."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("lookup").taking(
+            pmock.string_contains(str(i)))
+    return lambda: mock.lookup("0")
+
+
+def invoke_other_methods(count):
+    """Call a method on a mock with stubs for many other methods."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("method%d" % i)
+    return mock.method0
+
+
+def invoke_frozen(frozen):
+    """Call a method with an at_least_once() eq() expectation on a frozen
+    or unfrozen mock."""
+    mock = pmock.Mock()
+    mock.expects(pmock.at_least_once()).method("lookup").taking(
+        pmock.eq("key")).will(pmock.return_value(1))
+    if frozen:
+        mock.freeze()
+    invocation = pmock.Invocation("lookup", ("key",), {})
+    return lambda: mock.invoke(invocation)
+
+
+def invoke_once_script(count, dispatcher_class=None):
+    """Make calls matching a script of once() expectations in turn."""
+    if dispatcher_class is None:
+        mock = pmock.Mock()
+    else:
+        mock = pmock.Mock(dispatcher=dispatcher_class())
+    for i in xrange(count):
+        mock.expects(pmock.once()).method("step").taking(pmock.eq(i))
+    def run_script():
+        for i in xrange(count):
+            mock.step(i)
+    return run_script
+
+
+def invoke_counted(count):
+    """Make the calls of a script as one exactly() expectation."""
+    mock = pmock.Mock()
+    mock.expects(pmock.exactly(count)).method("step")
+    def run_script():
+        for i in xrange(count):
+            mock.step()
+    return run_script
+
+
+def repeated_call(mock_class=pmock.Mock):
+    """Call the same mocked method in a loop."""
+    mock = mock_class()
+    mock.stubs().method("lookup")
+    def call_lookup():
+        for i in xrange(100):
+            mock.lookup()
+    return call_lookup
+
+
+def delayed_call():
+    """Call a stub that sleeps a second on a virtual clock."""
+    mock = pmock.Mock()
+    mock.stubs().method("fetch").will(
+        pmock.delay(1, pmock.return_value(1), pmock.VirtualClock()))
+    def call_fetch():
+        for i in xrange(100):
+            mock.fetch()
+    return call_fetch
+
+
+def repeated_attribute_access():
+    """Look up the same mocked method without calling it."""
+    mock = pmock.Mock()
+    def get_lookup():
+        for i in xrange(100):
+            mock.lookup
+    return get_lookup
+
+
+def arguments_match():
+    """Match an invocation against a mix of argument constraints."""
+    matcher = pmock.AllArgumentsMatcher(
+        (pmock.eq("key"), pmock.same(None), pmock.string_contains("x")),
+        {"timeout": pmock.eq(1)})
+    invocation = pmock.Invocation("lookup", ("key", None, "xyz"),
+                                  {"timeout": 1})
+    return lambda: matcher.matches(invocation)
+
+
+##############################################################################
+# Verification and ordering
+##############################################################################
+
+def verify(count):
+    """Verify a mock whose at_least_once() expectations are satisfied."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.expects(pmock.at_least_once()).method("method%d" % i)
+        mock.invoke(pmock.Invocation("method%d" % i, (), {}))
+    return mock.verify
+
+
+def after_chain(count):
+    """Make calls through a chain of expectations ordered with after()."""
+    mock = pmock.Mock()
+    mock.expects(pmock.once()).method("step").taking(pmock.eq(0)).id("0")
+    for i in xrange(1, count):
+        mock.expects(pmock.once()).method("step").taking(
+            pmock.eq(i)).id(str(i)).after(str(i - 1))
+    def run_chain():
+        for i in xrange(count):
+            mock.step(i)
+    return run_chain
+
+
+def after_fan_in(count):
+    """Repeatedly call a method ordered after many others."""
+    mock = pmock.Mock()
+    builder = mock.expects(pmock.at_least_once()).method("collect")
+    for i in xrange(count):
+        mock.expects(pmock.once()).method("step%d" % i)
+        builder.after("step%d" % i)
+        getattr(mock, "step%d" % i)()
+    def call_collect():
+        for i in xrange(100):
+            mock.collect()
+    return call_collect
+
+
+##############################################################################
+# Threads
+##############################################################################
+
+def contended_calls(thread_count):
+    """Call a thread safe mock from many threads at once, each making 100
+    calls to a stub and 100 to an exactly() expectation, which is
+    verified afterwards to check no invocation was lost."""
+    def run_threads():
+        mock = pmock.ThreadSafeMock()
+        mock.stubs().method("read")
+        mock.expects(pmock.exactly(thread_count * 100)).method("write")
+        start = threading.Event()
+        def call_mock():
+            start.wait()
+            for i in xrange(100):
+                mock.read()
+                mock.write()
+        threads = [threading.Thread(target=call_mock)
+                   for i in xrange(thread_count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        mock.verify()
+    return run_threads
+
+
+def contended_matching(thread_count):
+    """Call a thread safe mock from many threads at once, each call
+    passing over 50 stubs whose argument constraints are evaluated before
+    reaching its exactly() expectation."""
+    def run_threads():
+        mock = pmock.ThreadSafeMock()
+        mock.expects(pmock.exactly(thread_count * 100)).method("handle")
+        for i in xrange(50):
+            mock.stubs().method("handle").taking(
+                pmock.functor(lambda request, i=i: request == i))
+        start = threading.Event()
+        def call_mock():
+            start.wait()
+            for i in xrange(100):
+                mock.handle(-1)
+        threads = [threading.Thread(target=call_mock)
+                   for i in xrange(thread_count)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+        mock.verify()
+    return run_threads
+
+
+def waited_call(wait_until_invoked):
+    """Wait for a call made by another thread, from starting the thread
+    to waking the waiting one."""
+    def wait_for_call():
+        mock = pmock.ThreadSafeMock()
+        builder = mock.expects(pmock.once()).method("notify")
+        caller = threading.Thread(target=mock.notify)
+        caller.start()
+        wait_until_invoked(mock, builder)
+        caller.join()
+    return wait_for_call
+
+
+def _sleep_polled(mock, builder):
+    while not mock.is_satisfied():
+        time.sleep(0.001)
+
+
+##############################################################################
+# Invocation log
+##############################################################################
+
+def logged_call(capacity=None, sample_every=1):
+    """Call a mocked method that records its invocations in a log."""
+    log = pmock.InvocationLog(capacity=capacity, sample_every=sample_every)
+    mock = pmock.Mock(invocation_log=log)
+    mock.stubs().method("write")
+    def call_write():
+        for i in xrange(100):
+            mock.write("data")
+    return call_write
+
+
+def _filled_log(count):
+    log = pmock.InvocationLog()
+    mock = pmock.Mock(invocation_log=log)
+    mock.set_default_stub(pmock.return_value(None))
+    args = ("data",)
+    for i in xrange(count):
+        mock.invoke(pmock.Invocation("method%d" % (i % 10), args, {}))
+    return log, args
+
+
+def log_select(count):
+    """Select the calls to one method, of ten, whose argument matches."""
+    log, args = _filled_log(count)
+    def select():
+        log.select("method3", pmock.functor(lambda data: len(data) > 2))
+    return select
+
+
+def log_entry_size():
+    """Bytes per invocation held by a log of many calls, excluding the
+    arguments."""
+    count = 10000
+    log, args = _filled_log(count)
+    return _size_in_bytes(log, excluded=[args]) / float(count)
+
+
+class _Payload(object):
+
+    def __init__(self, size):
+        self.data = "x" * size
+
+
+def captured_log_entry_size(capture, create_payload=_Payload):
+    """Bytes per invocation held by a log of calls passing 64KB payloads,
+    including whatever the capture policy keeps of them."""
+    count = 100
+    log = pmock.InvocationLog(capture=capture)
+    mock = pmock.Mock(invocation_log=log)
+    mock.set_default_stub(pmock.return_value(None))
+    payloads = [create_payload(65536) for i in xrange(count)]
+    for payload in payloads:
+        mock.send(payload)
+    size = _size_in_bytes(log, excluded=[_Payload])
+    return size / float(count)
+
+
+def _string_payload(size):
+    return "x" * size
+
+
+##############################################################################
+# Errors
+##############################################################################
+
+def caught_match_error(count):
+    """Make an unexpected call that the caller catches and ignores."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("lookup").taking(pmock.eq(i))
+    def call_unexpected():
+        try:
+            mock.lookup(-1)
+        except pmock.MatchError:
+            pass
+    return call_unexpected
+
+
+def reported_match_error(count):
+    """Make an unexpected call and read the error's message."""
+    mock = pmock.Mock()
+    for i in xrange(count):
+        mock.stubs().method("lookup").taking(pmock.eq(i))
+    def call_unexpected():
+        try:
+            mock.lookup(-1)
+        except pmock.MatchError, err:
+            err.msg
+    return call_unexpected
+
+
+##############################################################################
+# Test case
+##############################################################################
+
+class _PlainTest(unittest.TestCase):
+
+    def test_method(self):
+        pass
+
+
+class _MockTest(pmock.MockTestCase):
+
+    def test_method(self):
+        mock = self.mock()
+        mock.expects(pmock.once()).method("lookup")
+        mock.stubs().method("store")
+        mock.lookup()
+
+
+def test_case(test_class):
+    """Run a test case with an empty test, or one using a mock that is
+    verified automatically."""
+    def run_test():
+        test_class("test_method").run(unittest.TestResult())
+    return run_test
+
+
+##############################################################################
+# Memory
+##############################################################################
+
+def expectation_size():
+    """Bytes held by a typical expectation, excluding its mock."""
+    mock = pmock.Mock()
+    builder = mock.expects(pmock.once()).method("lookup").taking(
+        pmock.eq("key"), timeout=pmock.eq(1)).will(pmock.return_value(2))
+    return _size_in_bytes(builder._mocker,
+                          excluded=[builder, mock, pmock.__dict__])
+
+
+def invocation_size():
+    """Bytes held by an invocation's record, excluding its arguments."""
+    args = ("key",)
+    kwargs = {"timeout": 1}
+    invocation = pmock.Invocation("lookup", args, kwargs)
+    return _size_in_bytes(invocation,
+                          excluded=args + tuple(kwargs) + tuple(kwargs.values()))
+
+
+##############################################################################
+# Runner
+##############################################################################
+
+_COUNTS = (1, 100, 10000)
+
+
+def _timing(name, create_function, args=(), operations=1, number=None):
+    return TimingBenchmark(name, lambda: create_function(*args),
+                           operations, number)
+
+
+def benchmarks():
+    result = []
+    for count in _COUNTS:
+        result.append(_timing("define.expects[%d]" % count,
+                              define_expectations, (count,),
+                              operations=count))
+    for count in _COUNTS:
+        for format in ("csv", "jsonl"):
+            result.append(_timing("define.load_%s[%d]" % (format, count),
+                                  load_expectations, (count, format),
+                                  operations=count))
+    for count in _COUNTS + (100000,):
+        result.append(_timing("define.from_table[%d]" % count,
+                              define_table, (count,), operations=count))
+    for name, create_function in [("invoke.first_match", invoke_first_match),
+                                  ("invoke.eq_lookup", invoke_eq_lookup),
+                                  ("invoke.table_lookup",
+                                   invoke_table_lookup),
+                                  ("invoke.other_methods",
+                                   invoke_other_methods)]:
+        for count in _COUNTS:
+            result.append(_timing("%s[%d]" % (name, count), create_function,
+                                  (count,)))
+    for count in _COUNTS:
+        result.append(_timing("invoke.scan[%d]" % count, invoke_scan,
+                              (count,)))
+    for count in _COUNTS:
+        result.append(AllocationBenchmark(
+            "alloc.first_match[%d]" % count,
+            lambda count=count: invoke_first_match(count)))
+    for count in _COUNTS:
+        result.append(AllocationBenchmark(
+            "alloc.verify[%d]" % count, lambda count=count: verify(count)))
+    result.append(_timing("invoke.unfrozen", invoke_frozen, (False,)))
+    result.append(_timing("invoke.frozen", invoke_frozen, (True,)))
+    for count in (100, 1000):
+        result.append(_timing("invoke.once_script[%d]" % count,
+                              invoke_once_script, (count,),
+                              operations=count, number=1))
+        result.append(_timing("invoke.fifo_script[%d]" % count,
+                              invoke_once_script,
+                              (count, pmock.FifoDispatcher),
+                              operations=count, number=1))
+        result.append(_timing("invoke.counted[%d]" % count, invoke_counted,
+                              (count,), operations=count, number=1))
+    result.append(_timing("invoke.repeated_call", repeated_call,
+                          operations=100))
+    result.append(_timing("invoke.thread_safe_call", repeated_call,
+                          (pmock.ThreadSafeMock,), operations=100))
+    result.append(_timing("invoke.delayed_call", delayed_call,
+                          operations=100))
+    result.append(_timing("invoke.repeated_attribute_access",
+                          repeated_attribute_access, operations=100))
+    result.append(_timing("match.arguments", arguments_match))
+    for count in _COUNTS:
+        result.append(_timing("verify[%d]" % count, verify, (count,)))
+    for count in (10, 100, 1000):
+        result.append(_timing("order.after_chain[%d]" % count, after_chain,
+                              (count,), operations=count, number=1))
+        result.append(_timing("order.fan_in[%d]" % count, after_fan_in,
+                              (count,), operations=100))
+    for count in (1, 8):
+        result.append(_timing("threads.contended[%d]" % count,
+                              contended_calls, (count,),
+                              operations=count * 200))
+        result.append(_timing("threads.contended_matching[%d]" % count,
+                              contended_matching, (count,),
+                              operations=count * 100))
+    result.append(_timing("threads.wait_until_invoked", waited_call,
+                          (lambda mock, builder:
+                           mock.wait_until_invoked(builder, 10),)))
+    result.append(_timing("threads.sleep_polled", waited_call,
+                          (_sleep_polled,)))
+    result.append(_timing("log.logged_call", logged_call, operations=100))
+    result.append(_timing("log.bounded_call", logged_call, (100,),
+                          operations=100))
+    result.append(_timing("log.sampled_call", logged_call, (None, 100),
+                          operations=100))
+    for count in _COUNTS:
+        result.append(_timing("log.select[%d]" % count, log_select, (count,)))
+    for name, create_function in [("error.caught", caught_match_error),
+                                  ("error.reported", reported_match_error)]:
+        for count in _COUNTS:
+            result.append(_timing("%s[%d]" % (name, count), create_function,
+                                  (count,)))
+    result.append(_timing("testcase.plain", test_case, (_PlainTest,)))
+    result.append(_timing("testcase.mock", test_case, (_MockTest,)))
+    result.append(SizeBenchmark("size.expectation", expectation_size))
+    result.append(SizeBenchmark("size.invocation", invocation_size))
+    result.append(SizeBenchmark("size.log_entry", log_entry_size))
+    for name, capture in [("reference", None),
+                          ("weak_reference", pmock.WeakReferenceCapture()),
+                          ("fingerprint", pmock.FingerprintCapture()),
+                          ("truncated_repr", pmock.TruncatedReprCapture())]:
+        result.append(SizeBenchmark("size.captured_log_entry[%s]" % name,
+                                    lambda capture=capture:
+                                    captured_log_entry_size(capture)))
+    for name, capture in [("reference", None),
+                          ("weak_reference", pmock.WeakReferenceCapture())]:
+        result.append(SizeBenchmark(
+            "size.captured_str_log_entry[%s]" % name,
+            lambda capture=capture:
+            captured_log_entry_size(capture, _string_payload)))
+    return result
+
+
+def run(selected_benchmarks, repeat):
+    results = {}
+    for benchmark in selected_benchmarks:
+        summary = summarise(benchmark.run(repeat))
+        summary["unit"] = benchmark.unit
+        results[benchmark.name] = summary
+        print "%-40s %12.2f %12.2f %10.2f  %s" % (
+            benchmark.name, summary["min"], summary["median"],
+            summary["stdev"], benchmark.unit)
+    return results
+
+
+def write_json(results, filename):
+    document = {"python": platform.python_version(),
+                "pmock": pmock.__version__,
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "results": results}
+    json_file = open(filename, "w")
+    try:
+        json.dump(document, json_file, indent=2, sort_keys=True)
+    finally:
+        json_file.close()
+
+
+def read_json_results(filename):
+    json_file = open(filename)
+    try:
+        return json.load(json_file)["results"]
+    finally:
+        json_file.close()
+
+
+def compare(names, baseline_results, results, threshold):
+    """Change in the median of each named benchmark that is in both sets
+    of results.
+
+    @param threshold: percentage increase beyond which a change is a
+    regression, and decrease beyond which it is an improvement.
+    @return: list of (name, baseline median, median, percentage change,
+    status) tuples.
+    """
+    comparisons = []
+    for name in names:
+        if name not in baseline_results or name not in results:
+            continue
+        baseline_median = baseline_results[name]["median"]
+        median = results[name]["median"]
+        if baseline_median:
+            change = (median - baseline_median) * 100.0 / baseline_median
+        elif median > baseline_median:
+            # any growth from nothing, such as calls starting to keep
+            # objects, is beyond the threshold
+            change = float("inf")
+        else:
+            change = 0.0
+        if change > threshold:
+            status = "regressed"
+        elif change < -threshold:
+            status = "improved"
+        else:
+            status = ""
+        comparisons.append((name, baseline_median, median, change, status))
+    return comparisons
+
+
+def report_comparisons(comparisons):
+    print
+    print "%-40s %12s %12s %8s" % ("benchmark", "baseline", "median",
+                                   "change")
+    for name, baseline_median, median, change, status in comparisons:
+        print "%-40s %12.2f %12.2f %+7.1f%%  %s" % (
+            name, baseline_median, median, change, status)
+
+
+def main(argv):
+    parser = optparse.OptionParser(
+        usage="%prog [options] [NAME_SUBSTRING ...]")
+    parser.add_option("--repeat", type="int", default=7,
+                      help="timed repetitions of each benchmark")
+    parser.add_option("--json", metavar="FILE",
+                      help="write the results to FILE as JSON")
+    parser.add_option("--compare", metavar="FILE",
+                      help="compare the results with a baseline saved "
+                      "by --json")
+    parser.add_option("--threshold", type="float", default=10.0,
+                      metavar="PERCENT",
+                      help="change in median treated as noise when "
+                      "comparing [default: %default]")
+    options, names = parser.parse_args(argv)
+    selected = [b for b in benchmarks()
+                if not names or [n for n in names if n in b.name]]
+    if options.compare:
+        baseline_results = read_json_results(options.compare)
+        selected = [b for b in selected if b.name in baseline_results]
+    print "%-40s %12s %12s %10s" % ("benchmark", "min", "median", "stdev")
+    results = run(selected, options.repeat)
+    if options.json:
+        write_json(results, options.json)
+    if options.compare:
+        comparisons = compare([b.name for b in selected], baseline_results,
+                              results, options.threshold)
+        report_comparisons(comparisons)
+        for comparison in comparisons:
+            if comparison[4] == "regressed":
+                return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -60,18 +60,38 @@ __email__ = "grahamcarlyle at users dot sourceforge dot net"
 __version__ = "0.4-gma"
 
 
+import array
+import bisect
+import collections
+import csv
+import exceptions
+import hashlib
+import inspect
+import itertools
+import json
+import os
 import sys
+import threading
+import time
 import unittest
+import weakref
 
 
 ##############################################################################
 # Exported classes and functions
 ##############################################################################
 
-__all__ = ["Mock", "MockTestCase",
+__all__ = ["Mock", "ThreadSafeMock", "MockTestCase", "FifoDispatcher",
+           "InvocationLog",
+           "WeakReferenceCapture", "FingerprintCapture",
+           "TruncatedReprCapture",
            "once", "at_least_once", "never",
+           "exactly", "at_least", "at_most", "between",
+           "assert_in_order", "assert_before", "assert_between",
+           "load_expectations",
            "eq", "same", "string_contains", "functor",
-           "return_value", "raise_exception"]
+           "return_value", "raise_exception", "lookup", "delay",
+           "VirtualClock", "virtual_clock"]
 
 
 ##############################################################################
@@ -83,6 +103,57 @@ def _deprecated(message):
     print >> sys.stderr, "DEPRECATED: %s" % message
 
 
+def _is_exhausted(matcher):
+    is_exhausted = getattr(matcher, "is_exhausted", None)
+    return is_exhausted is not None and is_exhausted()
+
+
+def _defining_class(cls, name):
+    for klass in inspect.getmro(cls):
+        if name in klass.__dict__:
+            return klass
+    return None
+
+
+_TRUSTS_IS_SATISFIED = {}
+
+
+def _trusts_is_satisfied(cls):
+    """The class's is_satisfied method answers for its verify method.
+
+    A subclass overriding verify but not is_satisfied may fail verification
+    where the inherited is_satisfied says it would pass.
+    """
+    trusted = _TRUSTS_IS_SATISFIED.get(cls)
+    if trusted is None:
+        is_satisfied_class = _defining_class(cls, "is_satisfied")
+        verify_class = _defining_class(cls, "verify")
+        trusted = (is_satisfied_class is not None and
+                   (verify_class is None or
+                    issubclass(is_satisfied_class, verify_class)))
+        _TRUSTS_IS_SATISFIED[cls] = trusted
+    return trusted
+
+
+def _is_satisfied(matcher):
+    """Verifying the matcher is known to pass.
+
+    Matchers without an is_satisfied method can't tell, so they aren't.
+    Once is_satisfied returns True it must keep doing so: a mock stops
+    checking satisfied expectations, so a matcher whose verify could fail
+    again after further invocations must not define is_satisfied.
+    """
+    if type(matcher) in _IGNORES_VERIFY_TYPES:
+        return True
+    is_satisfied = getattr(matcher, "is_satisfied", None)
+    if is_satisfied is None:
+        return False
+    trusted = _TRUSTS_IS_SATISFIED.get(matcher.__class__)
+    if trusted is None:
+        trusted = _trusts_is_satisfied(matcher.__class__)
+    return trusted and is_satisfied()
+
+
 class Error(AssertionError):
 
     def __init__(self, msg):
@@ -105,16 +176,68 @@ class VerificationError(Error):
 
     create_error = classmethod(create_error)
 
+    def create_order_error(cls, earlier_invokable, later_invokable):
+        err_msg = "invoked out of order\n%s\nwas expected before\n%s" % (
+            earlier_invokable, later_invokable)
+        return VerificationError(err_msg)
+
+    create_order_error = classmethod(create_order_error)
+
 
 class MatchError(Error):
-    """Method call unexpected."""
-    
-    def create_error(cls, msg, invocation, mock):
-        err_msg = "%s\ninvoked %s" % (msg, invocation)
-        invokables_str = mock.invokables_str()
+    """Method call unexpected.
+
+    The message describing the invocation and the mock's expectations is
+    only built when first read, as the error is often caught by the code
+    under test, so it reflects the state of the mock at that point. The
+    error then lets go of the mock and invocation. Its args, and what is
+    pickled, hold just the message.
+    """
+
+    def __init__(self, msg, invocation=None, mock=None):
+        AssertionError.__init__(self, msg)
+        self._reason = msg
+        self._invocation = invocation
+        self._mock = mock
+        self._msg = None
+
+    def __str__(self):
+        return self.msg
+
+    def _get_msg(self):
+        if self._msg is None:
+            self._msg = self._create_msg()
+            self._invocation = None
+            self._mock = None
+        return self._msg
+
+    msg = property(_get_msg)
+
+    def _get_args(self):
+        return (self.msg,)
+
+    args = property(_get_args)
+
+    def __reduce__(self):
+        return (self.__class__, (self.msg,))
+
+    def _create_msg(self):
+        if self._invocation is None:
+            return self._reason
+        err_msg = "%s\ninvoked %s" % (self._reason, self._invocation)
+        invokables_str = self._mock.invokables_str()
         if invokables_str != "":
             err_msg += "\nin:\n" + invokables_str
-        return MatchError(err_msg)
+        recent_invocations_str = getattr(self._mock,
+                                         "recent_invocations_str", None)
+        if recent_invocations_str is not None:
+            invocations_str = recent_invocations_str(self._invocation)
+            if invocations_str != "":
+                err_msg += "\nrecent invocations:\n" + invocations_str
+        return err_msg
+    
+    def create_error(cls, msg, invocation, mock):
+        return MatchError(msg, invocation, mock)
 
     create_error = classmethod(create_error)
     
@@ -135,15 +258,51 @@ class DefinitionError(Error):
 
     create_duplicate_id_error = classmethod(create_duplicate_id_error)
 
+    def create_frozen_error(cls, description):
+        msg = "%s is frozen" % description
+        return DefinitionError(msg)
+
+    create_frozen_error = classmethod(create_frozen_error)
+
+    def create_invalid_count_error(cls, minimum, maximum):
+        msg = "invalid invocation count range: %s to %s" % (minimum, maximum)
+        return DefinitionError(msg)
+
+    create_invalid_count_error = classmethod(create_invalid_count_error)
+
+    def create_invalid_row_error(cls, row_number, problem):
+        msg = "row %d of expectations %s" % (row_number, problem)
+        return DefinitionError(msg)
+
+    create_invalid_row_error = classmethod(create_invalid_row_error)
+
+    def create_arguments_defined_error(cls, description):
+        msg = "arguments of %s are already defined" % description
+        return DefinitionError(msg)
+
+    create_arguments_defined_error = classmethod(
+        create_arguments_defined_error)
+
 
 class InvocationMocker(object):
     
+    __slots__ = ('_matchers', '_invocation_matcher', '_stub', '_id',
+                 '_matchers_to_check', '_matchers_to_invoke',
+                 '_matchers_to_verify', '_frozen', '_first_sequence',
+                 '_last_sequence')
+
     def __init__(self, invocation_matcher):
         self._matchers = []
         self._invocation_matcher = invocation_matcher
         self._matchers.append(invocation_matcher)
         self._stub = None
         self._id = None
+        self._matchers_to_check = self._matchers
+        self._matchers_to_invoke = self._matchers
+        self._matchers_to_verify = self._matchers
+        self._frozen = False
+        self._first_sequence = None
+        self._last_sequence = None
 
     def __str__(self):
         strs = ["%s: " % str(self._invocation_matcher)]
@@ -155,20 +314,76 @@ class InvocationMocker(object):
             strs.append(" [%s]" % self._id)
         return "".join(strs)
 
+    def check_definable(self):
+        """Raise a L{DefinitionError} if the definition can't change."""
+        if self._frozen:
+            raise DefinitionError.create_frozen_error("expectation %s" % self)
+
     def add_matcher(self, matcher):
+        self.check_definable()
         self._matchers.append(matcher)
 
     def set_stub(self, stub):
         self._stub = stub
 
-    def invoke(self, invocation):
+    def has_arguments_matcher(self):
+        """Whether a matcher of the invocation's arguments was added."""
         for matcher in self._matchers:
+            if isinstance(matcher, _ARGUMENTS_MATCHER_TYPES):
+                return True
+        return False
+
+    def freeze(self, method_name=None):
+        """Fix the matchers, leaving out any with nothing to do when
+        matching, invoking or verifying.
+
+        @param method_name: name of the only method that will be matched,
+        if it is already known.
+        """
+        self._frozen = True
+        self._matchers_to_check = tuple(
+            [m for m in self._matchers if not _always_matches(m, method_name)])
+        self._matchers_to_invoke = tuple(
+            [m for m in self._matchers if not _ignores_invoked(m)])
+        self._matchers_to_verify = tuple(
+            [m for m in self._matchers if not _ignores_verify(m)])
+
+    def invoke(self, invocation):
+        for matcher in self._matchers_to_invoke:
             matcher.invoked(invocation)
+        if self._first_sequence is None:
+            self._first_sequence = invocation.sequence
+        self._last_sequence = invocation.sequence
+        if self._stub is not None:
+            return self._stub.invoke(invocation)
+
+    def claim(self, invocation):
+        """Record the invocation if it matches, without running the stub.
+
+        L{ThreadSafeMock} calls this holding a lock for the mocker, so no
+        other invocation can be recorded between the match and the record.
+
+        @return: whether the invocation matched.
+        """
+        if not self.matches(invocation):
+            return False
+        for matcher in self._matchers_to_invoke:
+            matcher.invoked(invocation)
+        # invocations from other threads may be claimed out of sequence
+        sequence = invocation.sequence
+        if self._first_sequence is None or sequence < self._first_sequence:
+            self._first_sequence = sequence
+        if sequence > self._last_sequence:
+            self._last_sequence = sequence
+        return True
+
+    def invoke_stub(self, invocation):
+        """Run the stub for an invocation already claimed."""
         if self._stub is not None:
             return self._stub.invoke(invocation)
 
     def matches(self, invocation):
-        for matcher in self._matchers:
+        for matcher in self._matchers_to_check:
             if not matcher.matches(invocation):
                 return False
         return True
@@ -176,19 +391,182 @@ class InvocationMocker(object):
     def set_id(self, mocker_id):
         self._id = mocker_id
 
+    def get_first_sequence(self):
+        """Sequence number of the first invocation, or None."""
+        return self._first_sequence
+
+    def get_last_sequence(self):
+        """Sequence number of the latest invocation, or None."""
+        return self._last_sequence
+
+    def is_exhausted(self):
+        """The invocation matcher won't match any further invocations."""
+        return _is_exhausted(self._invocation_matcher)
+
+    def is_satisfied(self):
+        """Verifying is known to pass, and will keep passing however the
+        mocker is invoked afterwards."""
+        for matcher in self._matchers_to_verify:
+            if type(matcher) in _IGNORES_VERIFY_TYPES:
+                continue
+            is_satisfied = getattr(matcher, "is_satisfied", None)
+            if is_satisfied is None:
+                return False
+            trusted = _TRUSTS_IS_SATISFIED.get(matcher.__class__)
+            if trusted is None:
+                trusted = _trusts_is_satisfied(matcher.__class__)
+            if not (trusted and is_satisfied()):
+                return False
+        return True
+
     def verify(self):
         try:
-            for matcher in self._matchers:
+            for matcher in self._matchers_to_verify:
                 matcher.verify()
         except AssertionError, err:
             raise VerificationError.create_error(str(err), self)
 
 
+_LOOKUP_VALUE_TYPES = frozenset([str, unicode, int, long, float, bool,
+                                 type(None)])
+_NO_KWARGS_KEY = frozenset()
+
+
+def _is_lookup_value(value):
+    """Value's equality is consistent with its hash.
+
+    Only builtin types are trusted; user defined classes may define
+    equality without a matching hash.
+    """
+    value_type = type(value)
+    if value_type is tuple:
+        for item in value:
+            if not _is_lookup_value(item):
+                return False
+        return True
+    return value_type in _LOOKUP_VALUE_TYPES
+
+
+def _is_lookup_constraint(constraint):
+    return (type(constraint) is EqConstraint and
+            _is_lookup_value(constraint._expected))
+
+
+def _lookup_key(args, kwargs):
+    """Hashable key of the arguments, or None if they can't be looked up
+    by hash."""
+    for arg in args:
+        if not _is_lookup_value(arg):
+            return None
+    if not kwargs:
+        return (args, _NO_KWARGS_KEY)
+    for arg in kwargs.itervalues():
+        if not _is_lookup_value(arg):
+            return None
+    return (args, frozenset(kwargs.iteritems()))
+
+
+# checks inlined for the kinds of constraint that have one
+_CONSTRAINT_CHECKS = {"eq": "%s == %s", "same": "%s is %s"}
+
+# kinds of the constraint types with an inlined check, filled in once the
+# constraints are defined
+_CONSTRAINT_KINDS = {}
+
+
+def _constraint_check(kind, value_source, name):
+    if kind is None:
+        return "%s.eval(%s)" % (name, value_source)
+    return _CONSTRAINT_CHECKS[kind] % (name, value_source)
+
+
+# generated functions making argument match functions, keyed by the number
+# and kinds of constraint they check
+_MATCH_FUNCTION_FACTORIES = {}
+
+
+def _match_function_factory(shape):
+    all_arguments, arg_kinds, keyword_kinds = shape
+    parameters = ["arg%d" % i for i in range(len(arg_kinds))]
+    parameters.extend(["kwarg%d" % i for i in range(len(keyword_kinds))])
+    lines = ["def make_match_arguments(%s):" % ", ".join(parameters)]
+    # inlined checks compare with the constraint's expected value
+    kinds = list(arg_kinds) + [kind for kw, kind in keyword_kinds]
+    for parameter, kind in zip(parameters, kinds):
+        if kind is not None:
+            lines.append("  %s = %s._expected" % (parameter, parameter))
+    lines.append("  def match_arguments(args, kwargs):")
+    if all_arguments:
+        lines.append("    if len(args) != %d or len(kwargs) != %d:" %
+                     (len(arg_kinds), len(keyword_kinds)))
+        lines.append("        return False")
+    elif arg_kinds:
+        lines.append("    if len(args) < %d:" % len(arg_kinds))
+        lines.append("        return False")
+    for kw, kind in keyword_kinds:
+        lines.append("    if %r not in kwargs:" % kw)
+        lines.append("        return False")
+    checks = []
+    for i, kind in enumerate(arg_kinds):
+        checks.append(_constraint_check(kind, "args[%d]" % i, "arg%d" % i))
+    for i, (kw, kind) in enumerate(keyword_kinds):
+        checks.append(_constraint_check(kind, "kwargs[%r]" % kw,
+                                        "kwarg%d" % i))
+    for check in checks:
+        lines.append("    if not (%s):" % check)
+        lines.append("        return False")
+    lines.append("    return True")
+    lines.append("  return match_arguments")
+    namespace = {}
+    exec "\n".join(lines) in namespace
+    return namespace["make_match_arguments"]
+
+
+def _compile_arguments_match(arg_constraints, kwarg_constraints,
+                             all_arguments):
+    """Generate a function of an invocation's args and kwargs that checks
+    them against the constraints.
+
+    The number of arguments is checked before any constraint and the
+    eq() and same() comparisons are inlined. The code is generated once
+    for each number and kind of constraints, so defining many
+    expectations differing only in their expected values compiles
+    nothing after the first.
+    """
+    constraint_kinds = _CONSTRAINT_KINDS
+    arg_kinds = tuple([constraint_kinds.get(type(c))
+                       for c in arg_constraints])
+    if kwarg_constraints:
+        keywords = kwarg_constraints.keys()
+        keywords.sort()
+        keyword_constraints = [kwarg_constraints[kw] for kw in keywords]
+        keyword_kinds = tuple([(kw, constraint_kinds.get(type(c)))
+                               for kw, c in zip(keywords,
+                                                keyword_constraints)])
+        constraints = tuple(arg_constraints) + tuple(keyword_constraints)
+    else:
+        keyword_kinds = ()
+        constraints = arg_constraints
+    shape = (all_arguments, arg_kinds, keyword_kinds)
+    factory = _MATCH_FUNCTION_FACTORIES.get(shape)
+    if factory is None:
+        factory = _match_function_factory(shape)
+        _MATCH_FUNCTION_FACTORIES[shape] = factory
+    return factory(*constraints)
+
+
 class AbstractArgumentsMatcher(object):
 
+    __slots__ = ('_arg_constraints', '_kwarg_constraints',
+                 '_match_arguments')
+
+    _all_arguments = False
+
     def __init__(self, arg_constraints=(), kwarg_constraints={}):
         self._arg_constraints = arg_constraints
         self._kwarg_constraints = kwarg_constraints
+        self._match_arguments = _compile_arguments_match(
+            arg_constraints, kwarg_constraints, self._all_arguments)
 
     def _arg_strs(self):
         arg_strs = [str(c) for c in self._arg_constraints]
@@ -199,22 +577,8 @@ class AbstractArgumentsMatcher(object):
             arg_strs.append("%s=%s" % (kw, str(constraint)))
         return arg_strs
 
-    def _matches_args(self, invocation):
-        for i, constraint in enumerate(self._arg_constraints):
-            if not constraint.eval(invocation.args[i]):
-                return False
-        return True
-
-    def _matches_kwargs(self, invocation):
-        for kw, constraint in self._kwarg_constraints.iteritems():
-            if (not invocation.kwargs.has_key(kw) or
-                not constraint.eval(invocation.kwargs[kw])):
-                return False
-        return True
-
     def matches(self, invocation):
-        return (self._matches_args(invocation) and
-                self._matches_kwargs(invocation))
+        return self._match_arguments(invocation.args, invocation.kwargs)
 
     def invoked(self, invocation):
         pass
@@ -225,42 +589,92 @@ class AbstractArgumentsMatcher(object):
 
 class LeastArgumentsMatcher(AbstractArgumentsMatcher):
 
+    __slots__ = ()
+
     def __str__(self):
         arg_strs = AbstractArgumentsMatcher._arg_strs(self)
         arg_strs.append("...")
         return "(%s)" % ", ".join(arg_strs)
 
-    def _matches_args(self, invocation):
-        if len(self._arg_constraints) > len(invocation.args):
-            return False
-        return AbstractArgumentsMatcher._matches_args(self, invocation)
-
 
 ANY_ARGS_MATCHER = LeastArgumentsMatcher()
 
 
 class AllArgumentsMatcher(AbstractArgumentsMatcher):
 
+    __slots__ = ()
+
+    _all_arguments = True
+
     def __str__(self):
         return "(%s)" % ", ".join(AbstractArgumentsMatcher._arg_strs(self))
-        
-    def _matches_args(self, invocation):
-        if len(self._arg_constraints) != len(invocation.args):
-            return False
-        return AbstractArgumentsMatcher._matches_args(self, invocation)
 
-    def _matches_kwargs(self, invocation):
-        for invocation_kw in invocation.kwargs.iterkeys():
-            if invocation_kw not in self._kwarg_constraints:
-                return False
-        return AbstractArgumentsMatcher._matches_kwargs(self, invocation)
+    def lookup_key(self):
+        """Key of the only arguments that can match, or None if the
+        constraints aren't all equalities to simple values."""
+        for constraint in self._arg_constraints:
+            if not _is_lookup_constraint(constraint):
+                return None
+        for constraint in self._kwarg_constraints.itervalues():
+            if not _is_lookup_constraint(constraint):
+                return None
+        args = tuple([c._expected for c in self._arg_constraints])
+        kwargs = dict([(kw, c._expected)
+                       for kw, c in self._kwarg_constraints.iteritems()])
+        return _lookup_key(args, kwargs)
 
 
 NO_ARGS_MATCHER = AllArgumentsMatcher()
 
 
+def _table_key(args):
+    """Key of a table entry for a call's positional arguments.
+
+    A single argument is its own key unless it's a tuple, so tuple keys
+    always stand for all of the arguments: (1, 2) is the key of a call
+    with the arguments 1 and 2, and ((1, 2),) the key of a call with the
+    single argument (1, 2).
+    """
+    if len(args) == 1 and not isinstance(args[0], tuple):
+        return args[0]
+    return args
+
+
+class TableArgumentsMatcher(object):
+    """Matches calls whose arguments are a key of a table, found by hash
+    however big the table is. Calls with keyword arguments don't match."""
+
+    __slots__ = ('_table',)
+
+    def __init__(self, table):
+        self._table = table
+
+    def __str__(self):
+        return "(key of table)"
+
+    def matches(self, invocation):
+        if invocation.kwargs:
+            return False
+        try:
+            return _table_key(invocation.args) in self._table
+        except TypeError:
+            # unhashable arguments can't be keys
+            return False
+
+    def invoked(self, invocation):
+        pass
+
+    def verify(self):
+        pass
+
+
+_ARGUMENTS_MATCHER_TYPES = (AbstractArgumentsMatcher, TableArgumentsMatcher)
+
+
 class MethodMatcher(object):
 
+    __slots__ = ('_name',)
+
     def __init__(self, name):
         self._name = name
 
@@ -278,16 +692,45 @@ class MethodMatcher(object):
 
 
 class InvokedAfterMatcher(object):
+    """Matches once all of its predecessors have been invoked.
+
+    Predecessors that notify it when first invoked, like
+    L{PredecessorRecorderMatcher}, are counted down, so matching takes
+    constant time however many there are. Other invocation recorders are
+    asked on every match.
+    """
+
+    __slots__ = ('_waiting', '_polled_recorders', '_descriptions')
 
     def __init__(self, invocation_recorder, description):
-        self._invocation_recorder = invocation_recorder
-        self._description = description
+        self._waiting = 0
+        self._polled_recorders = ()
+        self._descriptions = ()
+        self.add_predecessor(invocation_recorder, description)
         
     def __str__(self):
-        return ".after(%s)" % self._description
+        return "".join([".after(%s)" % description
+                        for description in self._descriptions])
+
+    def add_predecessor(self, invocation_recorder, description):
+        self._descriptions += (description,)
+        add_successor = getattr(invocation_recorder, "add_successor", None)
+        if add_successor is None:
+            self._polled_recorders += (invocation_recorder,)
+        elif not invocation_recorder.has_been_invoked():
+            self._waiting += 1
+            add_successor(self)
+
+    def predecessor_invoked(self):
+        self._waiting -= 1
 
     def matches(self, invocation):
-        return self._invocation_recorder.has_been_invoked()
+        if self._waiting:
+            return False
+        for recorder in self._polled_recorders:
+            if not recorder.has_been_invoked():
+                return False
+        return True
 
     def invoked(self, invocation):
         pass
@@ -298,31 +741,43 @@ class InvokedAfterMatcher(object):
 
 class InvocationMockerBuilder(object):
 
+    __slots__ = ('_mocker', '_builder_namespace', '_predecessor_recorder',
+                 '_after_matcher')
+
     def __init__(self, mocker, builder_namespace):
         self._mocker = mocker
         self._builder_namespace = builder_namespace
+        self._predecessor_recorder = None
+        self._after_matcher = None
 
     def __call__(self, *arg_constraints, **kwarg_constraints):
-        self._mocker.add_matcher(AllArgumentsMatcher(arg_constraints,
-                                                     kwarg_constraints))
+        self._add_all_arguments_matcher(
+            AllArgumentsMatcher(arg_constraints, kwarg_constraints))
         return self
 
+    def _add_all_arguments_matcher(self, matcher):
+        self._mocker.add_matcher(matcher)
+        self._builder_namespace.index_lookup_key(matcher.lookup_key(),
+                                                 self._mocker)
+
     def __getattr__(self, name):
         """Define method name directly."""
         self._mocker.add_matcher(MethodMatcher(name))
         self._builder_namespace.register_method_name(name, self)
+        self._builder_namespace.index_method_name(name, self._mocker)
         return self
 
     def method(self, name):
         """Define method name."""
         self._mocker.add_matcher(MethodMatcher(name))
         self._builder_namespace.register_method_name(name, self)
+        self._builder_namespace.index_method_name(name, self._mocker)
         return self
 
     def taking(self, *arg_constraints, **kwarg_constraints):
         """Fully specify the method's arguments."""
-        self._mocker.add_matcher(AllArgumentsMatcher(arg_constraints,
-                                                     kwarg_constraints))
+        self._add_all_arguments_matcher(
+            AllArgumentsMatcher(arg_constraints, kwarg_constraints))
         return self
 
     def taking_at_least(self, *arg_constraints, **kwarg_constraints):
@@ -342,7 +797,7 @@ class InvocationMockerBuilder(object):
 
     def no_args(self):
         """Method takes no arguments."""
-        self._mocker.add_matcher(NO_ARGS_MATCHER)
+        self._add_all_arguments_matcher(NO_ARGS_MATCHER)
         return self
 
     def will(self, stub):
@@ -350,6 +805,24 @@ class InvocationMockerBuilder(object):
         self._mocker.set_stub(stub)
         return self
 
+    def from_table(self, table):
+        """Method takes the keys of a table, returning their values.
+
+        A call's single argument, or the tuple of its arguments, is looked
+        up in the table, which isn't copied. A single tuple argument is
+        looked up as a tuple of one argument, so calls taking different
+        numbers of arguments never share an entry.
+
+        @raise DefinitionError: if the method's arguments are already
+        specified, as by calling the builder.
+        """
+        if self._mocker.has_arguments_matcher():
+            raise DefinitionError.create_arguments_defined_error(
+                "expectation %s" % self._mocker)
+        self._mocker.add_matcher(TableArgumentsMatcher(table))
+        self._mocker.set_stub(LookupStub(table))
+        return self
+
     def id(self, id_str):
         """Define a id for use in other mock's L{after} method."""
         self._mocker.set_id(id_str)
@@ -368,23 +841,47 @@ class InvocationMockerBuilder(object):
         builder = builder_namespace.lookup_id(id_str)
         if builder is None:
             raise DefinitionError.create_unregistered_id_error(id_str)
-        invocation_recorder = InvokedRecorderMatcher()
-        builder.match(invocation_recorder)
-        matcher = InvokedAfterMatcher(invocation_recorder, description)
-        self._mocker.add_matcher(matcher)
+        invocation_recorder = builder._get_predecessor_recorder()
+        if self._after_matcher is None:
+            self._after_matcher = InvokedAfterMatcher(invocation_recorder,
+                                                      description)
+            self._mocker.add_matcher(self._after_matcher)
+        else:
+            self._mocker.check_definable()
+            self._after_matcher.add_predecessor(invocation_recorder,
+                                                description)
         return self
 
+    def _get_predecessor_recorder(self):
+        """Recorder shared by all the expectations ordered after this one."""
+        if self._predecessor_recorder is None:
+            recorder = PredecessorRecorderMatcher()
+            self.match(recorder)
+            self._predecessor_recorder = recorder
+        else:
+            self._mocker.check_definable()
+        return self._predecessor_recorder
+
     def match(self, matcher):
         self._mocker.add_matcher(matcher)
+        self._builder_namespace.update_satisfied(self._mocker)
         return self
 
 
+# invocations of all mocks are numbered from one sequence, so the order of
+# calls to different mocks can be compared
+_next_sequence = itertools.count(1).next
+
+
 class Invocation(object):
 
+    __slots__ = ('name', 'args', 'kwargs', 'sequence')
+
     def __init__(self, name, args, kwargs):
         self.name = name
         self.args = args
         self.kwargs = kwargs
+        self.sequence = _next_sequence()
 
     def __str__(self):
         arg_strs = [repr(arg) for arg in self.args]
@@ -397,6 +894,8 @@ class Invocation(object):
 
 class BoundMethod(object):
 
+    __slots__ = ('_name', '_mock')
+
     def __init__(self, name, mock):
         self._name = name
         self._mock = mock
@@ -407,6 +906,8 @@ class BoundMethod(object):
 
 class DefaultStub(object):
 
+    __slots__ = ()
+
     def invoke(self, invocation):
         raise AssertionError("no match found")
 
@@ -443,12 +944,717 @@ class Proxy(SpecialsMock):
         self._mock = mock
 
     def __getattr__(self, attr_name):
-        return BoundMethod(attr_name, self._mock)
+        method = BoundMethod(attr_name, self._mock)
+        self.__dict__[attr_name] = method
+        return method
 
     def _invoke_special(self, invocation):
         return self._mock._invoke_special(invocation)
 
 
+def _invokable_position(bucket, invokable):
+    for i in xrange(len(bucket) - 1, -1, -1):
+        if bucket[i][1] is invokable:
+            return i
+    return None
+
+
+def _entry_position(bucket, entry):
+    """Position of the invokable of an entry in a bucket, or None."""
+    position = bisect.bisect_left(bucket, (entry[0],))
+    if position < len(bucket) and bucket[position][1] is entry[1]:
+        return position
+    return None
+
+
+class InvokableIndex(object):
+    """Dispatcher trying the most recently added invokables first, grouped
+    by the name of the method they can match.
+
+    Invokables that haven't been given a method name are kept in a separate
+    bucket that is searched for every invocation. Named invokables whose
+    arguments must equal simple values are also filed under those values,
+    so a call with such arguments only considers the invokables expecting
+    them. Exhausted invokables are dropped from the index, though the mock
+    still has them for verification and error messages.
+
+    Each bucket holds (sequence, invokable, lookup key) entries in the order
+    the invokables were added.
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._unnamed = []
+        self._named = {}
+        self._unkeyed = {}
+        self._keyed = {}
+        self._names = {}
+        self._lock = None
+
+    def allow_concurrent_finds(self, lock):
+        """Let L{find_match} be called from several threads at once, and
+        while another thread holds the lock to call the other methods.
+
+        Buckets are then only changed by appending to them, and otherwise
+        replaced by changed copies, so a find scans a consistent bucket
+        without locking. Finds only take the lock to retire exhausted
+        invokables.
+        """
+        self._lock = lock
+
+    def _removed(self, bucket, position):
+        """The bucket without the entry at position."""
+        if self._lock is None:
+            del bucket[position]
+            return bucket
+        return bucket[:position] + bucket[position + 1:]
+
+    def _inserted(self, bucket, entry):
+        """The bucket with the entry inserted in order."""
+        position = bisect.bisect(bucket, entry)
+        if position == len(bucket):
+            bucket.append(entry)
+            return bucket
+        if self._lock is None:
+            bucket.insert(position, entry)
+            return bucket
+        return bucket[:position] + [entry] + bucket[position:]
+
+    def add(self, invokable):
+        self._unnamed.append((self._count, invokable, None))
+        self._count += 1
+
+    def add_indexed(self, invokable, name, key):
+        """Add an invokable filed straight under the method name and, if
+        it isn't None, the lookup key."""
+        entry = (self._count, invokable, key)
+        self._count += 1
+        self._names[id(invokable)] = name
+        self._named.setdefault(name, []).append(entry)
+        if key is None:
+            self._unkeyed.setdefault(name, []).append(entry)
+        else:
+            self._keyed.setdefault(name, {}).setdefault(key, []).append(entry)
+
+    def index_method_name(self, name, invokable):
+        unnamed = self._unnamed
+        position = _invokable_position(unnamed, invokable)
+        if position is not None:
+            entry = unnamed[position]
+            self._names[id(invokable)] = name
+            # filed under the name before leaving the unnamed bucket, so
+            # a concurrent find can't miss it
+            self._named[name] = self._inserted(self._named.get(name, []),
+                                               entry)
+            self._unkeyed[name] = self._inserted(
+                self._unkeyed.get(name, []), entry)
+            self._unnamed = self._removed(unnamed, position)
+
+    def method_name(self, invokable):
+        """Name the invokable is indexed under, or None."""
+        return self._names.get(id(invokable))
+
+    def index_lookup_key(self, key, invokable):
+        name = self._names.get(id(invokable))
+        if key is None or name is None:
+            return
+        unkeyed = self._unkeyed[name]
+        position = _invokable_position(unkeyed, invokable)
+        if position is not None:
+            entry = unkeyed[position]
+            keyed_entry = (entry[0], invokable, key)
+            named = self._named[name]
+            named[bisect.bisect_left(named, (entry[0],))] = keyed_entry
+            keyed = self._keyed.setdefault(name, {})
+            keyed[key] = self._inserted(keyed.get(key, []), keyed_entry)
+            self._unkeyed[name] = self._removed(unkeyed, position)
+
+    def _retire(self, entry):
+        lock = self._lock
+        if lock is None:
+            self._remove_entry(entry)
+            return
+        lock.acquire()
+        try:
+            self._remove_entry(entry)
+        finally:
+            lock.release()
+
+    def _remove_entry(self, entry):
+        invokable_id = id(entry[1])
+        name = self._names.get(invokable_id)
+        if name is None:
+            position = _entry_position(self._unnamed, entry)
+            if position is not None:
+                self._unnamed = self._removed(self._unnamed, position)
+            return
+        named = self._named[name]
+        position = _entry_position(named, entry)
+        if position is None:
+            # another thread's find retired it first
+            return
+        key = named[position][2]
+        del self._names[invokable_id]
+        self._named[name] = self._removed(named, position)
+        if key is None:
+            unkeyed = self._unkeyed[name]
+            self._unkeyed[name] = self._removed(
+                unkeyed, _entry_position(unkeyed, entry))
+        else:
+            keyed = self._keyed[name]
+            bucket = self._removed(keyed[key],
+                                   _entry_position(keyed[key], entry))
+            if bucket:
+                keyed[key] = bucket
+            else:
+                del keyed[key]
+
+    def _named_buckets(self, invocation):
+        name = invocation.name
+        keyed = self._keyed.get(name)
+        if keyed:
+            key = _lookup_key(invocation.args, invocation.kwargs)
+            if key is not None:
+                return keyed.get(key), self._unkeyed.get(name)
+        return self._named.get(name), None
+
+    def find_match(self, invocation):
+        """Return the most recently added invokable matching the
+        invocation, or None.
+
+        Exhausted invokables that are passed over are retired from the
+        index, so later invocations don't have to consider them again.
+        """
+        first, second = self._named_buckets(invocation)
+        unnamed = self._unnamed
+        if not unnamed:
+            if not second:
+                return self._find_match_in(first or (), invocation)
+            if not first:
+                return self._find_match_in(second, invocation)
+        elif not first and not second:
+            return self._find_match_in(unnamed, invocation)
+        buckets = [bucket for bucket in (first, second, unnamed) if bucket]
+        return self._find_merged_match(buckets, invocation)
+
+    def _find_match_in(self, bucket, invocation):
+        for position in xrange(len(bucket) - 1, -1, -1):
+            entry = bucket[position]
+            if entry[1].matches(invocation):
+                return entry[1]
+            if _is_exhausted(entry[1]):
+                self._retire(entry)
+        return None
+
+    def _find_merged_match(self, buckets, invocation):
+        positions = [len(bucket) - 1 for bucket in buckets]
+        while True:
+            latest = None
+            for i, bucket in enumerate(buckets):
+                position = positions[i]
+                if position >= 0 and (latest is None or
+                                      bucket[position][0] > latest[0]):
+                    latest = bucket[position]
+                    latest_bucket = i
+            if latest is None:
+                return None
+            positions[latest_bucket] -= 1
+            if latest[1].matches(invocation):
+                return latest[1]
+            if _is_exhausted(latest[1]):
+                self._retire(latest)
+
+    def verify_order(self, entries):
+        """Sort (position added, invokable) entries into the order they
+        are verified, latest first."""
+        entries.sort()
+        entries.reverse()
+
+
+class FifoDispatcher(object):
+    """Dispatcher trying invokables strictly in the order they were added.
+
+    Only the invokable at the head of the queue is tried. It's dropped
+    from the queue once exhausted, or once satisfied if an invocation
+    doesn't match it, so finding a match takes constant time however long
+    the queue. Invokables already satisfied when they are added, such as
+    stubs and never() expectations, aren't queued; they are tried in LIFO
+    order whenever the head of the queue doesn't match.
+    """
+
+    def __init__(self):
+        self._queue = collections.deque()
+        self._background = InvokableIndex()
+        self._lock = None
+
+    def allow_concurrent_finds(self, lock):
+        """As for L{InvokableIndex.allow_concurrent_finds}. Finds take the
+        lock to drop the head of the queue."""
+        self._lock = lock
+        self._background.allow_concurrent_finds(lock)
+
+    def add(self, invokable):
+        if _is_satisfied(invokable):
+            self._background.add(invokable)
+        else:
+            self._queue.append(invokable)
+
+    def add_indexed(self, invokable, name, key):
+        if _is_satisfied(invokable):
+            self._background.add_indexed(invokable, name, key)
+        else:
+            self._queue.append(invokable)
+
+    def index_method_name(self, name, invokable):
+        self._background.index_method_name(name, invokable)
+
+    def method_name(self, invokable):
+        """Name the invokable is indexed under, or None.
+
+        Queued invokables have no name here: the head of the queue is
+        tried against every invocation, so it must keep checking the name.
+        """
+        return self._background.method_name(invokable)
+
+    def index_lookup_key(self, key, invokable):
+        self._background.index_lookup_key(key, invokable)
+
+    def find_match(self, invocation):
+        """Return the invokable at the head of the queue if it matches the
+        invocation, else the most recently added unqueued match, or None.
+        """
+        queue = self._queue
+        while queue:
+            try:
+                head = queue[0]
+            except IndexError:
+                # emptied by another thread's find
+                break
+            if head.matches(invocation):
+                return head
+            if not (_is_exhausted(head) or _is_satisfied(head)):
+                break
+            if self._lock is None:
+                queue.popleft()
+            else:
+                self._drop_head(head)
+        return self._background.find_match(invocation)
+
+    def _drop_head(self, head):
+        self._lock.acquire()
+        try:
+            if self._queue and self._queue[0] is head:
+                self._queue.popleft()
+        finally:
+            self._lock.release()
+
+    def verify_order(self, entries):
+        """Sort (position added, invokable) entries into the order they
+        are verified, earliest first."""
+        entries.sort()
+
+
+def _logged_invocation(name, args, kwargs, sequence):
+    # bypasses __init__ so the invocation keeps its original sequence number
+    invocation = Invocation.__new__(Invocation)
+    invocation.name = name
+    invocation.args = args
+    invocation.kwargs = kwargs
+    invocation.sequence = sequence
+    return invocation
+
+
+# small values kept as they are by the capture policies
+_SCALAR_TYPES = frozenset([int, long, float, bool, type(None)])
+
+
+class _ArgumentReference(weakref.ref):
+
+    __slots__ = ('type_name',)
+
+
+class CollectedArgument(object):
+    """Stands in for a weakly referenced argument that no longer exists."""
+
+    __slots__ = ('type_name',)
+
+    def __init__(self, type_name):
+        self.type_name = type_name
+
+    def __repr__(self):
+        return "<collected %s>" % self.type_name
+
+
+class WeakReferenceCapture(object):
+    """Logs arguments by weak reference, so the log doesn't keep them
+    alive.
+
+    Arguments that can't be weakly referenced, such as strings, lists and
+    tuples, are logged by the fallback capture policy, a
+    L{FingerprintCapture} by default. Collected arguments are replaced by
+    a L{CollectedArgument}.
+    """
+
+    def __init__(self, fallback=None):
+        if fallback is None:
+            fallback = FingerprintCapture()
+        self._fallback = fallback
+
+    def capture(self, value):
+        try:
+            reference = _ArgumentReference(value)
+        except TypeError:
+            return self._fallback.capture(value)
+        reference.type_name = type(value).__name__
+        return reference
+
+    def restore(self, captured):
+        if type(captured) is not _ArgumentReference:
+            return self._fallback.restore(captured)
+        value = captured()
+        if value is None:
+            return CollectedArgument(captured.type_name)
+        return value
+
+
+def _fingerprint_digest(value, containers=()):
+    """SHA-1 digest of a value's contents.
+
+    @param containers: ids of the containers the value is in, to stop at
+    one that contains itself.
+    """
+    if isinstance(value, unicode):
+        value = value.encode("utf-8")
+    elif isinstance(value, (list, tuple, dict, set, frozenset)):
+        if id(value) in containers:
+            return hashlib.sha1("...").digest()
+        containers += (id(value),)
+        if isinstance(value, dict):
+            item_digests = [
+                _item_digest(key, containers) + _item_digest(item, containers)
+                for key, item in value.iteritems()]
+            item_digests.sort()
+        else:
+            item_digests = [_item_digest(item, containers) for item in value]
+            if not isinstance(value, (list, tuple)):
+                item_digests.sort()
+        return hashlib.sha1("".join(item_digests)).digest()
+    try:
+        return hashlib.sha1(value).digest()
+    except TypeError:
+        return hashlib.sha1(repr(value)).digest()
+
+
+def _item_digest(item, containers):
+    digest = hashlib.sha1(type(item).__name__)
+    digest.update(_fingerprint_digest(item, containers))
+    return digest.digest()
+
+
+class Fingerprint(object):
+    """Stands in for a logged argument, equal to any value with the same
+    type and contents.
+
+    Strings and other buffers are fingerprinted by their bytes, lists,
+    tuples, dicts and sets by the fingerprints of their items, and anything
+    else by its repr. Objects whose repr leaves out some of their contents
+    can therefore have equal fingerprints when they differ.
+    """
+
+    __slots__ = ('type_name', 'digest')
+
+    def __init__(self, value):
+        self.type_name = type(value).__name__
+        self.digest = _fingerprint_digest(value)
+
+    def __repr__(self):
+        return "<%s sha1:%s>" % (self.type_name,
+                                 self.digest.encode("hex")[:12])
+
+    def __eq__(self, other):
+        if not isinstance(other, Fingerprint):
+            other = Fingerprint(other)
+        return (self.type_name == other.type_name and
+                self.digest == other.digest)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.digest)
+
+
+class FingerprintCapture(object):
+    """Logs a L{Fingerprint} of each argument other than numbers, booleans
+    and None, which are logged as they are."""
+
+    def capture(self, value):
+        if type(value) in _SCALAR_TYPES:
+            return value
+        return Fingerprint(value)
+
+    def restore(self, captured):
+        return captured
+
+
+class TruncatedRepr(object):
+    """Stands in for a logged argument by the start of its repr, equal to
+    any value whose repr starts the same."""
+
+    __slots__ = ('text', 'max_length')
+
+    def __init__(self, value, max_length):
+        text = repr(value)
+        if len(text) > max_length:
+            text = text[:max_length] + "..."
+        self.text = text
+        self.max_length = max_length
+
+    def __repr__(self):
+        return self.text
+
+    def __eq__(self, other):
+        if not isinstance(other, TruncatedRepr):
+            other = TruncatedRepr(other, self.max_length)
+        return self.text == other.text
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.text)
+
+
+class TruncatedReprCapture(object):
+    """Logs a L{TruncatedRepr} of each argument other than numbers,
+    booleans and None, which are logged as they are."""
+
+    def __init__(self, max_length=80):
+        self._max_length = max_length
+
+    def capture(self, value):
+        if type(value) in _SCALAR_TYPES:
+            return value
+        return TruncatedRepr(value, self._max_length)
+
+    def restore(self, captured):
+        return captured
+
+
+class InvocationLog(object):
+    """Record of the invocations received by a mock.
+
+    Invocations are stored column-wise, with the method names and sequence
+    numbers in arrays alongside lists of the arguments, and the records are
+    indexed by method name. The log stays compact however many calls are
+    recorded, and the calls to one method are found without looking at
+    the others.
+
+    For mocks receiving very many calls the records kept can be limited,
+    while the count of calls to each method stays exact.
+
+    @param capacity: the most records kept, the oldest being dropped to
+    make room for new ones, or None to keep all of them.
+    @param sample_every: record one in this many calls to each method,
+    starting with the first.
+    @param report_count: number of the latest records described in a
+    L{MatchError}'s message.
+    @param capture: policy deciding what is kept of each argument, such as
+    a L{WeakReferenceCapture}, or None to keep the arguments themselves.
+    """
+
+    def __init__(self, capacity=None, sample_every=1, report_count=10,
+                 capture=None):
+        if capacity is not None and capacity < 1:
+            raise ValueError("capacity must be at least 1: %s" % capacity)
+        if sample_every < 1:
+            raise ValueError("sample_every must be at least 1: %s" %
+                             sample_every)
+        self._capacity = capacity
+        self._sample_every = sample_every
+        self.report_count = report_count
+        self._capture = capture
+        self._names = []
+        self._name_ids = {}
+        self._counts = []
+        # records are numbered in the order they were made; with a capacity
+        # record n is kept in slot n % capacity of the columns
+        self._record_count = 0
+        self._name_column = array.array('i')
+        self._sequence_column = array.array('l')
+        self._args_column = []
+        self._kwargs_column = []
+        # record numbers for each method, from _index_starts onwards once
+        # older records have been dropped
+        self._records_by_name_id = []
+        self._index_starts = []
+
+    def __len__(self):
+        """Number of records kept."""
+        return self._record_count - self._oldest_record()
+
+    def _oldest_record(self):
+        if self._capacity is None or self._record_count <= self._capacity:
+            return 0
+        return self._record_count - self._capacity
+
+    def _add_name(self, name):
+        name_id = len(self._names)
+        self._names.append(name)
+        self._name_ids[name] = name_id
+        self._counts.append(0)
+        self._records_by_name_id.append(array.array('l'))
+        self._index_starts.append(0)
+        return name_id
+
+    def record(self, invocation):
+        name_id = self._name_ids.get(invocation.name)
+        if name_id is None:
+            name_id = self._add_name(invocation.name)
+        count = self._counts[name_id]
+        self._counts[name_id] = count + 1
+        if count % self._sample_every:
+            return
+        args = invocation.args
+        kwargs = invocation.kwargs or None
+        capture = self._capture
+        if capture is not None:
+            args = tuple([capture.capture(arg) for arg in args])
+            if kwargs is not None:
+                kwargs = dict([(keyword, capture.capture(arg))
+                               for keyword, arg in kwargs.iteritems()])
+        record = self._record_count
+        self._record_count = record + 1
+        capacity = self._capacity
+        if capacity is None or record < capacity:
+            self._name_column.append(name_id)
+            self._sequence_column.append(invocation.sequence)
+            self._args_column.append(args)
+            self._kwargs_column.append(kwargs)
+        else:
+            slot = record % capacity
+            self._drop_oldest_record_of(self._name_column[slot])
+            self._name_column[slot] = name_id
+            self._sequence_column[slot] = invocation.sequence
+            self._args_column[slot] = args
+            self._kwargs_column[slot] = kwargs
+        self._records_by_name_id[name_id].append(record)
+
+    def _drop_oldest_record_of(self, name_id):
+        records = self._records_by_name_id[name_id]
+        start = self._index_starts[name_id] + 1
+        # compacting only once half the index is dropped keeps the cost
+        # per record constant
+        if start * 2 >= len(records):
+            del records[:start]
+            start = 0
+        self._index_starts[name_id] = start
+
+    def get_method_names(self):
+        """Names of the methods invoked, in order of first invocation."""
+        return list(self._names)
+
+    def count(self, name=None):
+        """Number of invocations of the named method, or of all methods,
+        including any not recorded."""
+        if name is None:
+            return sum(self._counts)
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            return 0
+        return self._counts[name_id]
+
+    def _slots(self, records):
+        capacity = self._capacity
+        if capacity is None:
+            return records
+        return (record % capacity for record in records)
+
+    def _records(self, name):
+        if name is None:
+            return xrange(self._oldest_record(), self._record_count)
+        name_id = self._name_ids.get(name)
+        if name_id is None:
+            return ()
+        return self._records_by_name_id[name_id][self._index_starts[name_id]:]
+
+    def _arguments(self, slot):
+        args = self._args_column[slot]
+        kwargs = self._kwargs_column[slot] or _NO_KWARGS
+        capture = self._capture
+        if capture is not None:
+            restore = capture.restore
+            args = tuple([restore(arg) for arg in args])
+            kwargs = dict([(keyword, restore(arg))
+                           for keyword, arg in kwargs.iteritems()])
+        return args, kwargs
+
+    def _invocation(self, slot):
+        args, kwargs = self._arguments(slot)
+        if kwargs is _NO_KWARGS:
+            kwargs = {}
+        return _logged_invocation(self._names[self._name_column[slot]],
+                                  args, kwargs, self._sequence_column[slot])
+
+    def select(self, *name_and_arg_constraints, **kwarg_constraints):
+        """Recorded invocations of the named method, or of any method, in
+        the order they were received.
+
+        Called as select([name, *arg_constraints], **kwarg_constraints).
+        The method name is only taken positionally, so keyword constraints
+        can have any name, including name.
+
+        @param name_and_arg_constraints: the method name, or None for any
+        method, followed by constraints the arguments must satisfy,
+        applied as by L{InvocationMockerBuilder.taking_at_least}.
+        @return: list of L{Invocation}
+        """
+        if name_and_arg_constraints:
+            name = name_and_arg_constraints[0]
+            arg_constraints = name_and_arg_constraints[1:]
+        else:
+            name = None
+            arg_constraints = ()
+        slots = self._slots(self._records(name))
+        if arg_constraints or kwarg_constraints:
+            match_arguments = LeastArgumentsMatcher(
+                arg_constraints, kwarg_constraints)._match_arguments
+            if self._capture is None:
+                args_column = self._args_column
+                kwargs_column = self._kwargs_column
+                slots = [slot for slot in slots
+                         if match_arguments(args_column[slot],
+                                            kwargs_column[slot] or
+                                            _NO_KWARGS)]
+            else:
+                arguments = self._arguments
+                slots = [slot for slot in slots
+                         if match_arguments(*arguments(slot))]
+        return [self._invocation(slot) for slot in slots]
+
+    def recent(self, count, until_sequence=None):
+        """The latest recorded invocations, oldest first.
+
+        @param until_sequence: sequence number of the latest invocation
+        wanted, leaving out any received after it.
+        @return: list of at most count L{Invocation}s
+        """
+        oldest = self._oldest_record()
+        record = self._record_count
+        if until_sequence is not None:
+            for slot in self._slots(xrange(record - 1, oldest - 1, -1)):
+                if self._sequence_column[slot] <= until_sequence:
+                    break
+                record -= 1
+        slots = self._slots(xrange(max(oldest, record - count), record))
+        return [self._invocation(slot) for slot in slots]
+
+
+# read only, standing in for the keyword arguments of logged calls that had
+# none
+_NO_KWARGS = {}
+
+
 def mock_str(mock):
     return "<pmock.Mock id=%s>" % id(mock)
 
@@ -456,15 +1662,35 @@ def mock_str(mock):
 class Mock(SpecialsMock):
     """A mock object."""
 
-    def __init__(self, name=None):
+    def __init__(self, name=None, freeze_on_invoke=False, dispatcher=None,
+                 invocation_log=None):
+        """
+        @param dispatcher: finds the invokable matching each invocation,
+        an L{InvokableIndex} trying the latest definitions first by default
+        or a L{FifoDispatcher}.
+        @param invocation_log: an L{InvocationLog} recording every
+        invocation received, if given.
+        """
         self._name = name
+        self._frozen = False
+        self._freeze_on_invoke = freeze_on_invoke
         self._invokables = []
+        if dispatcher is None:
+            dispatcher = InvokableIndex()
+        self._dispatcher = dispatcher
+        self._invocation_log = invocation_log
+        # invokables not known to be satisfied, by id: (position, invokable)
+        self._unsatisfied = {}
         self._proxy = Proxy(self)
         self._default_stub = _DEFAULT_STUB
         self._id_table = {}
 
     def __getattr__(self, attr_name):
-        return BoundMethod(attr_name, self)
+        # cached in the instance so later lookups don't reach __getattr__,
+        # which is only called for names the mock doesn't already define
+        method = BoundMethod(attr_name, self)
+        self.__dict__[attr_name] = method
+        return method
 
     def get_name(self):
         if self._name is not None:
@@ -472,9 +1698,6 @@ class Mock(SpecialsMock):
         else:
             return mock_str(self)
 
-    def _get_match_order_invokables(self):
-        return self._invokables[::-1] # LIFO
-
     def lookup_id(self, builder_id):
         return self._id_table.get(builder_id, None)
 
@@ -485,13 +1708,31 @@ class Mock(SpecialsMock):
 
     def register_method_name(self, builder_id, builder):
         self._id_table[builder_id] = builder
+
+    def index_method_name(self, name, invokable):
+        self._dispatcher.index_method_name(name, invokable)
+
+    def index_lookup_key(self, key, invokable):
+        self._dispatcher.index_lookup_key(key, invokable)
         
     def invoke(self, invocation):
+        if self._invocation_log is not None:
+            self._invocation_log.record(invocation)
+        if self._freeze_on_invoke:
+            self.freeze()
         try:
-            matching_invokable = None
-            for invokable in self._get_match_order_invokables():
-                if invokable.matches(invocation):
-                    return invokable.invoke(invocation)
+            invokable = self._dispatcher.find_match(invocation)
+            if invokable is not None:
+                result = invokable.invoke(invocation)
+                # an invokable whose invoke raised just stays unsatisfied,
+                # to be checked again on verifying
+                unsatisfied = self._unsatisfied
+                invokable_id = id(invokable)
+                if invokable_id in unsatisfied:
+                    is_satisfied = getattr(invokable, "is_satisfied", None)
+                    if is_satisfied is not None and is_satisfied():
+                        del unsatisfied[invokable_id]
+                return result
             return self._default_stub.invoke(invocation)
         except AssertionError, err:
             raise MatchError.create_error(str(err), invocation, self)
@@ -499,13 +1740,50 @@ class Mock(SpecialsMock):
     def _invoke_special(self, invocation):
         return self.invoke(invocation)
             
-    def add_invokable(self, invokable):
+    def add_invokable(self, invokable, method_name=None, lookup_key=None):
+        """Add an invokable, which if the method name is given only
+        matches calls to that method, and if the lookup key is given only
+        calls with arguments having that L{_lookup_key}.
+
+        Giving them indexes the invokable in one step, instead of with
+        L{index_method_name} and L{index_lookup_key} afterwards.
+        """
+        if self._frozen:
+            raise DefinitionError.create_frozen_error(
+                "mock %s" % repr(self.get_name()))
+        if not _is_satisfied(invokable):
+            self._unsatisfied[id(invokable)] = (len(self._invokables),
+                                                invokable)
         self._invokables.append(invokable)
+        if method_name is None:
+            self._dispatcher.add(invokable)
+        else:
+            self._dispatcher.add_indexed(invokable, method_name, lookup_key)
+
+    def update_satisfied(self, invokable):
+        """Check again whether the invokable needs verifying, after its
+        definition changed."""
+        if _is_satisfied(invokable):
+            self._unsatisfied.pop(id(invokable), None)
+        elif not self._unsatisfied.has_key(id(invokable)):
+            for position, other in enumerate(self._invokables):
+                if other is invokable:
+                    self._unsatisfied[id(invokable)] = (position, invokable)
+                    break
 
     def invokables_str(self):
         invokable_strs = [str(invokable) for invokable in self._invokables]
         return ",\n".join(invokable_strs)
 
+    def recent_invocations_str(self, invocation):
+        """The latest logged invocations up to the given one, if the mock
+        has an invocation log."""
+        log = self._invocation_log
+        if log is None:
+            return ""
+        invocations = log.recent(log.report_count, invocation.sequence)
+        return "\n".join([str(logged) for logged in invocations])
+
     def expects(self, invocation_matcher):
         """Define an expectation for a method.
 
@@ -527,6 +1805,22 @@ class Mock(SpecialsMock):
     def set_default_stub(self, stub):
         """Set the default behaviour of undefined methods."""
         self._default_stub = stub
+
+    def freeze(self):
+        """End the definition of the mock's expectations.
+
+        The expectations are prepared for faster matching and any further
+        definitions raise a L{DefinitionError}.
+        """
+        self._freeze_on_invoke = False
+        if self._frozen:
+            return
+        dispatcher = self._dispatcher
+        for invokable in self._invokables:
+            freeze = getattr(invokable, "freeze", None)
+            if freeze is not None:
+                freeze(dispatcher.method_name(invokable))
+        self._frozen = True
         
     def proxy(self):
         """Return a proxy to the mock object.
@@ -536,14 +1830,475 @@ class Mock(SpecialsMock):
         """ 
         return self._proxy
     
+    def is_satisfied(self):
+        """Return whether L{verify} would pass.
+
+        Only expectations not already known to be satisfied are checked,
+        so a satisfied mock usually answers at once.
+        """
+        try:
+            self.verify()
+        except AssertionError:
+            return False
+        return True
+
     def verify(self):
-        """Check that the mock object has been called as expected."""
-        for invokable in self._get_match_order_invokables():
+        """Check that the mock object has been called as expected.
+
+        Expectations are verified in the dispatcher's order, LIFO by
+        default, skipping those already known to be satisfied. An
+        expectation is never checked again once its is_satisfied method
+        has returned True, so is_satisfied must only go from False to
+        True.
+        """
+        if not self._unsatisfied:
+            return
+        unsatisfied = self._unsatisfied.values()
+        self._dispatcher.verify_order(unsatisfied)
+        for position, invokable in unsatisfied:
             invokable.verify()
 
 
+_CLAIM_LOCK_COUNT = 64
+
+
+class ThreadSafeMock(Mock):
+    """A mock object that may be invoked from several threads at once.
+
+    Matching an invocation and recording it against the matching
+    expectation is one atomic step, so racing threads can't both invoke a
+    once() expectation. A candidate expectation is found without locking
+    if the dispatcher has an allow_concurrent_finds method, as
+    L{InvokableIndex} and L{FifoDispatcher} do, and otherwise under the
+    mock's lock. The candidate is then claimed under a lock shared with
+    few other expectations, checking again that it matches before
+    recording the invocation, and if another thread's claim used it up
+    first the invocation is matched again. Stubs run with no lock held,
+    so a slow or blocking stub doesn't hold up calls to other methods.
+
+    The mock's lock is only taken on invocation to record it in the
+    invocation log, if there is one, to freeze the mock on its first
+    invocation, and to drop exhausted expectations from the dispatcher.
+
+    Tests can wait for calls from other threads with L{wait_until_invoked}
+    and L{wait_until_satisfied}, which are woken as soon as a call is
+    claimed.
+
+    Invokables must have claim and invoke_stub methods, as
+    L{InvocationMocker} does.
+    """
+
+    def __init__(self, name=None, freeze_on_invoke=False, dispatcher=None,
+                 invocation_log=None):
+        Mock.__init__(self, name, freeze_on_invoke, dispatcher,
+                      invocation_log)
+        self._lock = threading.Lock()
+        allow_concurrent_finds = getattr(self._dispatcher,
+                                         "allow_concurrent_finds", None)
+        self._concurrent_finds = allow_concurrent_finds is not None
+        if self._concurrent_finds:
+            allow_concurrent_finds(self._lock)
+        # expectations are spread over these by id, so claims of different
+        # expectations rarely wait for each other
+        self._claim_locks = [threading.Lock()
+                             for i in xrange(_CLAIM_LOCK_COUNT)]
+        self._claimed = threading.Condition(self._lock)
+        # threads waiting on _claimed, which is only notified if there are
+        # any
+        self._waiters = 0
+
+    def _locked(self, method, *args):
+        self._lock.acquire()
+        try:
+            return method(self, *args)
+        finally:
+            self._lock.release()
+
+    def index_method_name(self, name, invokable):
+        self._locked(Mock.index_method_name, name, invokable)
+
+    def index_lookup_key(self, key, invokable):
+        self._locked(Mock.index_lookup_key, key, invokable)
+
+    def add_invokable(self, invokable, method_name=None, lookup_key=None):
+        self._locked(Mock.add_invokable, invokable, method_name, lookup_key)
+
+    def update_satisfied(self, invokable):
+        self._locked(Mock.update_satisfied, invokable)
+
+    def freeze(self):
+        self._locked(Mock.freeze)
+
+    def _claim(self, invokable, invocation):
+        claim_lock = self._claim_locks[(id(invokable) >> 4) %
+                                       _CLAIM_LOCK_COUNT]
+        claim_lock.acquire()
+        try:
+            return invokable.claim(invocation)
+        finally:
+            claim_lock.release()
+
+    def _find_match(self, invocation):
+        if self._concurrent_finds:
+            return self._dispatcher.find_match(invocation)
+        self._lock.acquire()
+        try:
+            return self._dispatcher.find_match(invocation)
+        finally:
+            self._lock.release()
+
+    def _record(self, invocation):
+        self._lock.acquire()
+        try:
+            if self._invocation_log is not None:
+                self._invocation_log.record(invocation)
+            if self._freeze_on_invoke:
+                Mock.freeze(self)
+        finally:
+            self._lock.release()
+
+    def invoke(self, invocation):
+        try:
+            if self._invocation_log is not None or self._freeze_on_invoke:
+                self._record(invocation)
+            invokable = self._find_match(invocation)
+            while invokable is not None:
+                if self._claim(invokable, invocation):
+                    if self._waiters:
+                        self._notify_waiters()
+                    result = invokable.invoke_stub(invocation)
+                    invokable_id = id(invokable)
+                    if (invokable_id in self._unsatisfied and
+                        _is_satisfied(invokable)):
+                        self._unsatisfied.pop(invokable_id, None)
+                    return result
+                # another thread's claim got there first
+                invokable = self._find_match(invocation)
+            return self._default_stub.invoke(invocation)
+        except AssertionError, err:
+            raise MatchError.create_error(str(err), invocation, self)
+
+    def _notify_waiters(self):
+        self._claimed.acquire()
+        try:
+            self._claimed.notifyAll()
+        finally:
+            self._claimed.release()
+
+    def _wait(self, is_done, timeout):
+        """Wait until is_done returns true, returning False if timeout
+        seconds pass first."""
+        claimed = self._claimed
+        timed_out = []
+        def time_out():
+            claimed.acquire()
+            try:
+                timed_out.append(True)
+                claimed.notifyAll()
+            finally:
+                claimed.release()
+        timer = None
+        claimed.acquire()
+        self._waiters += 1
+        try:
+            while not is_done():
+                if timed_out:
+                    return False
+                if timer is None and timeout is not None:
+                    # python's own timed waits poll, so would wake late.
+                    # The timer isn't a daemon thread, as those can fail
+                    # when the interpreter exits before they have finished
+                    # polling for their cancellation.
+                    timer = threading.Timer(timeout, time_out)
+                    timer.start()
+                claimed.wait()
+            return True
+        finally:
+            self._waiters -= 1
+            claimed.release()
+            if timer is not None:
+                timer.cancel()
+
+    def wait_until_invoked(self, builder, timeout=None):
+        """Wait until one of the mock's expectations has been invoked and
+        is satisfied.
+
+        @param builder: the builder returned when defining the expectation,
+        or by L{lookup_id}.
+        @param timeout: the most seconds to wait, or None to wait for as
+        long as it takes.
+        @raise VerificationError: if the expectation still hasn't been
+        invoked or isn't satisfied after the timeout.
+        """
+        mocker = builder._mocker
+        def is_invoked():
+            if mocker.get_first_sequence() is None:
+                return False
+            try:
+                mocker.verify()
+            except AssertionError:
+                return False
+            return True
+        if not self._wait(is_invoked, timeout):
+            if mocker.get_first_sequence() is None:
+                raise VerificationError.create_error(
+                    "expected method was not invoked", mocker)
+            mocker.verify()
+
+    def wait_until_satisfied(self, timeout=None):
+        """Wait until L{verify} would pass.
+
+        @param timeout: the most seconds to wait, or None to wait for as
+        long as it takes.
+        @raise VerificationError: if the mock still isn't satisfied after
+        the timeout.
+        """
+        if not self._wait(self.is_satisfied, timeout):
+            self.verify()
+
+
+def assert_in_order(*builders):
+    """Check that expectations were invoked in the given order.
+
+    Every invocation of each expectation must come before any invocation
+    of the next. The expectations may belong to different mocks.
+
+    @param builders: the builders returned when defining the expectations,
+    or by L{Mock.lookup_id}.
+    @raise VerificationError: if an expectation wasn't invoked or the
+    order was wrong.
+    """
+    previous = None
+    for builder in builders:
+        mocker = builder._mocker
+        if mocker.get_first_sequence() is None:
+            raise VerificationError.create_error(
+                "expected method was not invoked", mocker)
+        if (previous is not None and
+            previous.get_last_sequence() > mocker.get_first_sequence()):
+            raise VerificationError.create_order_error(previous, mocker)
+        previous = mocker
+
+
+def assert_before(earlier, later):
+    """Check that one expectation was invoked before another.
+
+    See L{assert_in_order}.
+    """
+    assert_in_order(earlier, later)
+
+
+def assert_between(first, middle, last):
+    """Check that an expectation was invoked after one and before another.
+
+    See L{assert_in_order}.
+    """
+    assert_in_order(first, middle, last)
+
+
+##############################################################################
+# Loading expectations from files
+##############################################################################
+
+_FORMATS_BY_EXTENSION = {".csv": "csv", ".json": "json", ".jsonl": "jsonl",
+                         ".ndjson": "jsonl"}
+
+_ROW_FIELDS = frozenset(["method", "args", "kwargs", "returns", "raises",
+                         "count"])
+
+# columns of a csv file whose cells are JSON values
+_JSON_COLUMNS = ("args", "kwargs", "returns")
+
+
+def _native_strings(value):
+    """JSON value with its plain ASCII strings as str rather than unicode."""
+    value_type = type(value)
+    if value_type is unicode:
+        try:
+            return value.encode("ascii")
+        except UnicodeError:
+            return value
+    if value_type is list:
+        return [_native_strings(item) for item in value]
+    if value_type is dict:
+        return dict([(_native_strings(key), _native_strings(item))
+                     for key, item in value.iteritems()])
+    return value
+
+
+def _json_rows(source):
+    try:
+        rows = json.load(source)
+    except ValueError, err:
+        raise DefinitionError("expectations aren't valid JSON: %s" % err)
+    if type(rows) is not list:
+        raise DefinitionError("expectations must be a JSON list of rows")
+    return rows
+
+
+def _json_lines_rows(source):
+    row_number = 0
+    for line in source:
+        if line.strip():
+            row_number += 1
+            try:
+                yield json.loads(line)
+            except ValueError, err:
+                raise DefinitionError.create_invalid_row_error(
+                    row_number, "isn't valid JSON: %s" % err)
+
+
+def _csv_rows(source):
+    row_number = 0
+    for cells in csv.DictReader(source):
+        row_number += 1
+        row = {}
+        for column, cell in cells.iteritems():
+            if cell:
+                try:
+                    if column in _JSON_COLUMNS:
+                        cell = json.loads(cell)
+                    elif column == "count":
+                        cell = int(cell)
+                except ValueError, err:
+                    raise DefinitionError.create_invalid_row_error(
+                        row_number, "has invalid %s: %s" % (column, err))
+                row[column] = cell
+        yield row
+
+
+_ROW_READERS = {"csv": _csv_rows, "json": _json_rows,
+                "jsonl": _json_lines_rows}
+
+
+def _exception_from(description, exception_types, row_number):
+    """Exception described as "Type" or "Type: message"."""
+    type_name, separator, message = _native_strings(description).partition(
+        ":")
+    type_name = type_name.strip()
+    exception_type = exception_types.get(type_name)
+    if exception_type is None:
+        exception_type = getattr(exceptions, type_name, None)
+    if exception_type is None:
+        raise DefinitionError.create_invalid_row_error(
+            row_number, "raises unknown exception type: %s" % type_name)
+    if separator:
+        return exception_type(message.strip())
+    return exception_type()
+
+
+def _load_expectation(mock, row, row_number, exception_types):
+    if type(row) is not dict:
+        raise DefinitionError.create_invalid_row_error(row_number,
+                                                       "isn't an object")
+    unknown_fields = [str(field) for field in row
+                      if field not in _ROW_FIELDS]
+    if unknown_fields:
+        unknown_fields.sort()
+        raise DefinitionError.create_invalid_row_error(
+            row_number, "has unknown fields: %s" % ", ".join(unknown_fields))
+    # the rows' keys and any other strings decoded from JSON are unicode,
+    # which compare and hash equal to the str of plain ASCII strings
+    name = _native_strings(row.get("method"))
+    if not name:
+        raise DefinitionError.create_invalid_row_error(row_number,
+                                                       "has no method")
+    problem = None
+    args = row.get("args")
+    kwargs = row.get("kwargs")
+    count = row.get("count")
+    if not isinstance(name, basestring):
+        problem = "method isn't a string"
+    elif args is not None and type(args) is not list:
+        problem = "args isn't a list"
+    elif kwargs is not None and type(kwargs) is not dict:
+        problem = "kwargs isn't an object"
+    elif "raises" in row and not isinstance(row["raises"], basestring):
+        problem = "raises isn't a string"
+    elif count is not None and (type(count) not in (int, long) or
+                                count < 0):
+        problem = "count isn't a non-negative integer"
+    if problem is not None:
+        raise DefinitionError.create_invalid_row_error(row_number, problem)
+    args = tuple(_native_strings(args or ()))
+    kwargs = _native_strings(kwargs or {})
+    if count is None:
+        mocker = InvocationMocker(_STUB_MATCHER_INSTANCE)
+    else:
+        mocker = InvocationMocker(CountInvocationMatcher(count, count))
+    mocker.add_matcher(MethodMatcher(name))
+    mocker.add_matcher(AllArgumentsMatcher(
+        tuple([EqConstraint(arg) for arg in args]),
+        dict([(kw, EqConstraint(arg)) for kw, arg in kwargs.iteritems()])))
+    if "raises" in row:
+        if "returns" in row:
+            raise DefinitionError.create_invalid_row_error(
+                row_number, "both returns and raises")
+        mocker.set_stub(RaiseExceptionStub(
+            _exception_from(row["raises"], exception_types, row_number)))
+    elif "returns" in row:
+        mocker.set_stub(ReturnValueStub(_native_strings(row["returns"])))
+    mock.add_invokable(mocker, name, _lookup_key(args, kwargs))
+    return name, mocker
+
+
+def load_expectations(mock, source, format=None, exception_types={}):
+    """Define expectations and stubs for a mock from the rows of a file.
+
+    Each row has a method name and may have args (a list), kwargs (an
+    object), the value it returns, the exception it raises, and a count
+    of the calls expected, a non-negative integer. Rows without a count
+    define stubs. Rows with any other field aren't valid. The
+    arguments must equal those given. An exception is described as "Type"
+    or "Type: message", the type being a builtin exception or one named
+    in exception_types.
+
+    JSON files hold a list of rows and JSON lines files a row per line,
+    each an object with method, args, kwargs, returns, raises and count
+    fields. CSV files have columns of the same names, with args, kwargs
+    and returns as JSON values. Empty cells are left out.
+
+    The expectations are built directly rather than with
+    L{InvocationMockerBuilder}s, though the last row for each method is
+    registered under its name for use with L{InvocationMockerBuilder.after}.
+
+    @param source: file name or open file.
+    @param format: "csv", "json" or "jsonl", by default taken from the
+    file name's extension.
+    @return: number of rows loaded.
+    @raise DefinitionError: if a row isn't valid.
+    """
+    if isinstance(source, basestring):
+        source_file = open(source, "rb")
+    else:
+        source_file = source
+    try:
+        if format is None:
+            extension = os.path.splitext(getattr(source_file, "name", ""))[1]
+            format = _FORMATS_BY_EXTENSION.get(extension.lower())
+        read_rows = _ROW_READERS.get(format)
+        if read_rows is None:
+            raise ValueError("unknown expectations format: %s" % format)
+        last_mockers = {}
+        row_count = 0
+        for row in read_rows(source_file):
+            row_count += 1
+            name, mocker = _load_expectation(mock, row, row_count,
+                                             exception_types)
+            last_mockers[name] = mocker
+    finally:
+        if source_file is not source:
+            source_file.close()
+    for name, mocker in last_mockers.iteritems():
+        mock.register_method_name(name, InvocationMockerBuilder(mocker, mock))
+    return row_count
+
+
 class MockTestCase(unittest.TestCase):
 
+    # freeze each mock created by the mock method when it is first invoked
+    freeze_mocks = False
+
     def __init__(self, methodName='runTest'):
         unittest.TestCase.__init__(self, methodName)
         self._test_method_name = methodName
@@ -556,16 +2311,28 @@ class MockTestCase(unittest.TestCase):
     
     def __call__(self, result=None):
         self._mocks = []
+        _VIRTUAL_CLOCK.reset()
         self._real_test_method = getattr(self, self._test_method_name)
         setattr(self, self._test_method_name, self._auto_verified_test)
         unittest.TestCase.__call__(self, result)
         setattr(self, self._test_method_name, self._real_test_method)
+        _VIRTUAL_CLOCK.uninstall()
 
-    def mock(self):
+    def mock(self, dispatcher=None, invocation_log=None, thread_safe=False):
         """Create a mock object that will be automatically verified
         after the test is run.
+
+        @param dispatcher: as for L{Mock}.
+        @param invocation_log: as for L{Mock}.
+        @param thread_safe: create a L{ThreadSafeMock}.
         """
-        mock = Mock()
+        if thread_safe:
+            mock_class = ThreadSafeMock
+        else:
+            mock_class = Mock
+        mock = mock_class(freeze_on_invoke=self.freeze_mocks,
+                          dispatcher=dispatcher,
+                          invocation_log=invocation_log)
         self._mocks.append(mock)
         return mock
 
@@ -576,6 +2343,8 @@ class MockTestCase(unittest.TestCase):
 
 class ReturnValueStub(object):
     
+    __slots__ = ('_value',)
+
     def __init__(self, value):
         self._value = value
 
@@ -596,6 +2365,8 @@ def return_value(value):
 
 class RaiseExceptionStub(object):
 
+    __slots__ = ('_exception',)
+
     def __init__(self, exception):
         self._exception = exception
 
@@ -614,30 +2385,213 @@ def raise_exception(exception):
     return RaiseExceptionStub(exception)
 
 
+_NO_DEFAULT = object()
+
+
+def _entries_str(count):
+    if count == 1:
+        return "1 entry"
+    return "%d entries" % count
+
+
+class LookupStub(object):
+
+    __slots__ = ('_table', '_default')
+
+    def __init__(self, table, default=_NO_DEFAULT):
+        self._table = table
+        self._default = default
+
+    def __str__(self):
+        if self._default is _NO_DEFAULT:
+            return "looks up table of %s" % _entries_str(len(self._table))
+        return "looks up table of %s, default %s" % (
+            _entries_str(len(self._table)), repr(self._default))
+
+    def invoke(self, invocation):
+        if not invocation.kwargs:
+            try:
+                return self._table[_table_key(invocation.args)]
+            except (KeyError, TypeError):
+                pass
+        if self._default is _NO_DEFAULT:
+            raise AssertionError("no table entry for arguments")
+        return self._default
+
+
+def lookup(table, default=_NO_DEFAULT):
+    """Stub that returns the value in a table for the call's single
+    argument, or the tuple of its arguments. A single tuple argument is
+    looked up as a tuple of one argument.
+
+    Convenience function for creating a L{LookupStub} instance.
+
+    @param default: value returned for arguments that aren't in the table,
+    which otherwise raise a L{MatchError}.
+    """
+    return LookupStub(table, default)
+
+
+class VirtualClock(object):
+    """Clock whose time only moves when something sleeps on it.
+
+    Its time and sleep methods stand in for time.time and time.sleep, so
+    timeouts and backoff can be tested at full speed. They can be passed
+    to the code under test, or put in place of the time module's own
+    with L{install}.
+    """
+
+    def __init__(self, start=0.0):
+        self._start = start
+        self._now = start
+        self._installed = None
+
+    def time(self):
+        """Current virtual time in seconds."""
+        return self._now
+
+    def sleep(self, seconds):
+        """Move the clock on by the given seconds, returning at once."""
+        if seconds < 0:
+            raise ValueError("sleep length must be non-negative: %s" %
+                             seconds)
+        self._now += seconds
+
+    def install(self, module=None):
+        """Replace the time and sleep functions of a module, the time
+        module by default, with the clock's until L{uninstall} is called.
+        """
+        if module is None:
+            module = time
+        self.uninstall()
+        self._installed = (module, module.time, module.sleep)
+        module.time = self.time
+        module.sleep = self.sleep
+
+    def uninstall(self):
+        """Put back the functions replaced by L{install}."""
+        if self._installed is None:
+            return
+        module, module.time, module.sleep = self._installed
+        self._installed = None
+
+    def reset(self):
+        """Uninstall the clock and put its time back to the start."""
+        self.uninstall()
+        self._now = self._start
+
+
+_VIRTUAL_CLOCK = VirtualClock()
+
+
+def virtual_clock():
+    """The virtual clock used by L{delay} stubs unless given another.
+
+    L{MockTestCase} resets it before each test and uninstalls it after.
+    """
+    return _VIRTUAL_CLOCK
+
+
+class DelayStub(object):
+
+    __slots__ = ('_seconds', '_stub', '_clock')
+
+    def __init__(self, seconds, stub=None, clock=None):
+        if clock is None:
+            clock = _VIRTUAL_CLOCK
+        self._seconds = seconds
+        self._stub = stub
+        self._clock = clock
+
+    def __str__(self):
+        if self._stub is None:
+            return "delays %s seconds" % self._seconds
+        return "%s after %s seconds" % (self._stub, self._seconds)
+
+    def invoke(self, invocation):
+        self._clock.sleep(self._seconds)
+        if self._stub is not None:
+            return self._stub.invoke(invocation)
+
+
+def delay(seconds, stub=None, clock=None):
+    """Stub that sleeps on a clock before invoking another stub, if given.
+
+    Convenience function for creating a L{DelayStub} instance.
+
+    @param clock: anything with a sleep method, the clock returned by
+    L{virtual_clock} by default.
+    """
+    return DelayStub(seconds, stub, clock)
+
+
 ##############################################################################
 # Invocation matchers
 ############################################################################## 
 
 class InvokedRecorderMatcher(object):
 
+    __slots__ = ('_count',)
+
     def __init__(self):
-        self._invoked = False
+        self._count = 0
 
     def has_been_invoked(self):
-        return self._invoked
+        return self._count > 0
+
+    def get_invocation_count(self):
+        return self._count
+
+    def is_exhausted(self):
+        return False
+
+    def is_satisfied(self):
+        return True
     
     def matches(self, invocation):
         return True
 
     def invoked(self, invocation):
-        self._invoked = True
+        self._count += 1
 
     def verify(self):
         pass
 
     
+class PredecessorRecorderMatcher(InvokedRecorderMatcher):
+    """Records invocations of an expectation that others are ordered after,
+    telling their L{InvokedAfterMatcher}s when it is first invoked."""
+
+    __slots__ = ('_successors',)
+
+    def __init__(self):
+        InvokedRecorderMatcher.__init__(self)
+        self._successors = []
+
+    def add_successor(self, after_matcher):
+        self._successors.append(after_matcher)
+
+    def invoked(self, invocation):
+        self._count += 1
+        if self._count == 1:
+            # a successor may have other predecessors invoked by other
+            # threads at the same time
+            _PREDECESSOR_LOCK.acquire()
+            try:
+                for after_matcher in self._successors:
+                    after_matcher.predecessor_invoked()
+            finally:
+                _PREDECESSOR_LOCK.release()
+            self._successors = None
+
+
+_PREDECESSOR_LOCK = threading.Lock()
+
+    
 class OnceInvocationMatcher(InvokedRecorderMatcher):
 
+    __slots__ = ()
+
     def __str__(self):
         if self.has_been_invoked():
             return "expected once and has been invoked"
@@ -647,6 +2601,12 @@ class OnceInvocationMatcher(InvokedRecorderMatcher):
     def matches(self, invocation):
         return not self.has_been_invoked()
 
+    def is_exhausted(self):
+        return self.has_been_invoked()
+
+    def is_satisfied(self):
+        return self.has_been_invoked()
+
     def verify(self):
         if not self.has_been_invoked():
             raise AssertionError("expected method was not invoked")
@@ -662,6 +2622,8 @@ def once():
 
 class AtLeastOnceInvocationMatcher(InvokedRecorderMatcher):
 
+    __slots__ = ()
+
     def __str__(self):
         if self.has_been_invoked():
             return "expected at least once and has been invoked"
@@ -671,6 +2633,9 @@ class AtLeastOnceInvocationMatcher(InvokedRecorderMatcher):
     def matches(self, invocation):
         return True
 
+    def is_satisfied(self):
+        return self.has_been_invoked()
+
     def verify(self):
         if not self.has_been_invoked():
             raise AssertionError("expected method was not invoked")
@@ -685,8 +2650,100 @@ def at_least_once():
     return AtLeastOnceInvocationMatcher()
 
 
+def _times_str(count):
+    if count == 1:
+        return "1 time"
+    return "%d times" % count
+
+
+class CountInvocationMatcher(InvokedRecorderMatcher):
+    """Method will be called between a minimum and an optional maximum
+    number of times."""
+
+    __slots__ = ('_minimum', '_maximum')
+
+    def __init__(self, minimum, maximum=None):
+        if minimum < 0 or (maximum is not None and maximum < minimum):
+            raise DefinitionError.create_invalid_count_error(minimum, maximum)
+        InvokedRecorderMatcher.__init__(self)
+        self._minimum = minimum
+        self._maximum = maximum
+
+    def _range_str(self):
+        if self._maximum is None:
+            return "at least %s" % _times_str(self._minimum)
+        if self._minimum == self._maximum:
+            return "exactly %s" % _times_str(self._minimum)
+        if self._minimum == 0:
+            return "at most %s" % _times_str(self._maximum)
+        return "between %d and %s" % (self._minimum,
+                                      _times_str(self._maximum))
+
+    def __str__(self):
+        if self.has_been_invoked():
+            return "expected %s and has been invoked %s" % (
+                self._range_str(), _times_str(self._count))
+        else:
+            return "expected %s" % self._range_str()
+
+    def matches(self, invocation):
+        return self._maximum is None or self._count < self._maximum
+
+    def invoked(self, invocation):
+        if self._maximum is not None and self._count >= self._maximum:
+            raise AssertionError("expected method to be invoked %s" %
+                                 self._range_str())
+        self._count += 1
+
+    def is_exhausted(self):
+        return self._maximum is not None and self._count >= self._maximum
+
+    def is_satisfied(self):
+        return self._count >= self._minimum
+
+    def verify(self):
+        if self._count < self._minimum:
+            raise AssertionError(
+                "expected method to be invoked %s but was invoked %s" %
+                (self._range_str(), _times_str(self._count)))
+
+
+def exactly(count):
+    """Method will be called exactly count times.
+
+    Convenience function for creating a L{CountInvocationMatcher} instance.
+    """
+    return CountInvocationMatcher(count, count)
+
+
+def at_least(count):
+    """Method will be called count or more times.
+
+    Convenience function for creating a L{CountInvocationMatcher} instance.
+    """
+    return CountInvocationMatcher(count)
+
+
+def at_most(count):
+    """Method will be called no more than count times.
+
+    Convenience function for creating a L{CountInvocationMatcher} instance.
+    """
+    return CountInvocationMatcher(0, count)
+
+
+def between(minimum, maximum):
+    """Method will be called from minimum to maximum times, inclusive.
+
+    Convenience function for creating a L{CountInvocationMatcher} instance.
+    """
+    return CountInvocationMatcher(minimum, maximum)
+
+
 class NotCalledInvocationMatcher(object):
 
+    __slots__ = ()
+
     def __str__(self):
         return "expected not to be called"
 
@@ -713,6 +2770,8 @@ def never():
 
 class StubInvocationMatcher(object):
 
+    __slots__ = ()
+
     def __str__(self):
         return "stub"
     
@@ -729,12 +2788,52 @@ class StubInvocationMatcher(object):
 _STUB_MATCHER_INSTANCE = StubInvocationMatcher()
 
 
+# Matchers of these exact types have nothing to do in one or more of their
+# methods, so frozen invocation mockers can leave them out.
+
+_ALWAYS_MATCHING_TYPES = frozenset([InvokedRecorderMatcher,
+                                    PredecessorRecorderMatcher,
+                                    AtLeastOnceInvocationMatcher,
+                                    NotCalledInvocationMatcher,
+                                    StubInvocationMatcher])
+
+_IGNORES_INVOKED_TYPES = frozenset([MethodMatcher,
+                                    LeastArgumentsMatcher,
+                                    AllArgumentsMatcher,
+                                    TableArgumentsMatcher,
+                                    InvokedAfterMatcher,
+                                    StubInvocationMatcher])
+
+_IGNORES_VERIFY_TYPES = _IGNORES_INVOKED_TYPES | frozenset(
+    [InvokedRecorderMatcher, PredecessorRecorderMatcher,
+     NotCalledInvocationMatcher])
+
+
+def _always_matches(matcher, method_name):
+    if matcher is ANY_ARGS_MATCHER:
+        return True
+    matcher_type = type(matcher)
+    if matcher_type is MethodMatcher:
+        return matcher._name == method_name
+    return matcher_type in _ALWAYS_MATCHING_TYPES
+
+
+def _ignores_invoked(matcher):
+    return type(matcher) in _IGNORES_INVOKED_TYPES
+
+
+def _ignores_verify(matcher):
+    return type(matcher) in _IGNORES_VERIFY_TYPES
+
+
 ##############################################################################
 # Argument constraints
 ############################################################################## 
 
 class EqConstraint(object):
 
+    __slots__ = ('_expected',)
+
     def __init__(self, expected):
         self._expected = expected
 
@@ -755,6 +2854,8 @@ def eq(expected):
 
 class SameConstraint(object):
 
+    __slots__ = ('_expected',)
+
     def __init__(self, expected):
         self._expected = expected
 
@@ -773,8 +2874,13 @@ def same(expected):
     return SameConstraint(expected)
 
 
+_CONSTRAINT_KINDS.update({EqConstraint: "eq", SameConstraint: "same"})
+
+
 class StringContainsConstraint(object):
 
+    __slots__ = ('_expected',)
+
     def __init__(self, expected):
         self._expected = expected
 
@@ -795,6 +2901,8 @@ def string_contains(expected):
 
 class FunctorConstraint(object):
 
+    __slots__ = ('_boolean_functor',)
+
     def __init__(self, boolean_functor):
         self._boolean_functor = boolean_functor
 
@@ -1,4 +1,9 @@
+import StringIO
+import cPickle
+import pickle
 import sys
+import threading
+import time
 import unittest
 
 import pmock
@@ -34,6 +39,69 @@ class MatchErrorTest(unittest.TestCase):
                                               self.Mock("invokables"))
         self.assertEqual(error.msg, "msg\ninvoked call\nin:\ninvokables")
 
+    def test_str(self):
+        error = pmock.MatchError.create_error("msg",
+                                              self.MockInvocation(),
+                                              self.Mock("invokables"))
+        self.assertEqual(str(error), "msg\ninvoked call\nin:\ninvokables")
+
+    def test_message_created_when_first_read(self):
+        class Mock:
+            def __init__(self): self.str_calls = 0
+            def invokables_str(self):
+                self.str_calls += 1
+                return "invokables"
+        mock = Mock()
+        error = pmock.MatchError.create_error("msg", self.MockInvocation(),
+                                              mock)
+        self.assertEqual(mock.str_calls, 0)
+        str(error)
+        error.msg
+        self.assertEqual(mock.str_calls, 1)
+
+    def test_recent_invocations(self):
+        class Mock(self.Mock):
+            def recent_invocations_str(self, invocation): return "calls"
+        error = pmock.MatchError.create_error("msg",
+                                              self.MockInvocation(),
+                                              Mock("invokables"))
+        self.assertEqual(error.msg, "msg\ninvoked call\nin:\ninvokables\n"
+                         "recent invocations:\ncalls")
+
+    def test_args_hold_message(self):
+        error = pmock.MatchError.create_error("msg",
+                                              self.MockInvocation(),
+                                              self.Mock("invokables"))
+        self.assertEqual(error.args, ("msg\ninvoked call\nin:\ninvokables",))
+
+    def test_mock_released_once_message_built(self):
+        error = pmock.MatchError.create_error("msg",
+                                              self.MockInvocation(),
+                                              self.Mock("invokables"))
+        str(error)
+        self.assert_(error._mock is None)
+        self.assert_(error._invocation is None)
+        self.assertEqual(str(error), "msg\ninvoked call\nin:\ninvokables")
+
+    def test_pickled_as_message(self):
+        mock = pmock.Mock()
+        mock.expects(pmock.once()).howl()
+        try:
+            mock.bark()
+            self.fail("expected bark to raise")
+        except pmock.MatchError, err:
+            for pickler in [pickle, cPickle]:
+                for protocol in [0, 2]:
+                    copied = pickler.loads(pickler.dumps(err, protocol))
+                    self.assert_(isinstance(copied, pmock.MatchError))
+                    self.assertEqual(copied.msg, err.msg)
+                    self.assertEqual(copied.args, err.args)
+
+    def test_without_invocation(self):
+        error = pmock.MatchError("msg")
+        self.assertEqual(error.msg, "msg")
+        self.assertEqual(str(error), "msg")
+
 
 class ArgumentsMatcherTestMixin(object):
 
@@ -84,6 +152,20 @@ class ArgumentsMatcherTestMixin(object):
         invocation = pmock.Invocation("snake", (), {"food": "goat"})
         self.assert_(not args_matcher.matches(invocation))
 
+    def test_insufficient_arguments_not_evaluated(self):
+        class UnevaluatedConstraint:
+            def eval(self, invocation): raise AssertionError("evaluated")
+        args_matcher = self.matcher_class((pmock.eq("slither"),
+                                           UnevaluatedConstraint()),
+                                          {"food": UnevaluatedConstraint()})
+        self.assert_(not args_matcher.matches(
+            pmock.Invocation("snake", ("slither",), {"food": "goat"})))
+        self.assert_(not args_matcher.matches(
+            pmock.Invocation("snake", ("slither", "hiss"), {})))
+
+    def test_constraint_only_needed_when_evaluated(self):
+        self.matcher_class(("slither",), {"food": "goat"})
+
 
 class AllArgumentsMatcherTest(ArgumentsMatcherTestMixin, unittest.TestCase):
 
@@ -120,6 +202,41 @@ class AllArgumentsMatcherTest(ArgumentsMatcherTestMixin, unittest.TestCase):
     def test_empty_str(self):
         self.assertEqual(str(pmock.AllArgumentsMatcher()), "()")
 
+    def test_matchers_differing_in_values_only(self):
+        slither = pmock.AllArgumentsMatcher((pmock.eq("slither"),),
+                                            {"food": pmock.same(None)})
+        hiss = pmock.AllArgumentsMatcher((pmock.eq("hiss"),),
+                                         {"food": pmock.same(None)})
+        invocation = pmock.Invocation("snake", ("hiss",), {"food": None})
+        self.assert_(not slither.matches(invocation))
+        self.assert_(hiss.matches(invocation))
+
+    def test_eq_lookup_key(self):
+        matcher = pmock.AllArgumentsMatcher(
+            (pmock.eq("slither"), pmock.eq((1, None))),
+            {"food": pmock.eq(u"goat")})
+        self.assertEqual(matcher.lookup_key(),
+                         pmock._lookup_key(("slither", (1, None)),
+                                           {"food": u"goat"}))
+
+    def test_no_arguments_lookup_key(self):
+        self.assertEqual(pmock.AllArgumentsMatcher().lookup_key(),
+                         pmock._lookup_key((), {}))
+
+    def test_no_lookup_key_for_other_constraints(self):
+        matcher = pmock.AllArgumentsMatcher((pmock.same("slither"),), {})
+        self.assert_(matcher.lookup_key() is None)
+        matcher = pmock.AllArgumentsMatcher(
+            (), {"food": pmock.string_contains("goat")})
+        self.assert_(matcher.lookup_key() is None)
+
+    def test_no_lookup_key_for_user_defined_values(self):
+        class Food: pass
+        matcher = pmock.AllArgumentsMatcher((pmock.eq(Food()),), {})
+        self.assert_(matcher.lookup_key() is None)
+        matcher = pmock.AllArgumentsMatcher((pmock.eq([1]),), {})
+        self.assert_(matcher.lookup_key() is None)
+
 
 class LeastArgumentsMatcherTest(ArgumentsMatcherTestMixin, unittest.TestCase):
 
@@ -257,6 +374,120 @@ class InvocationMockerTest(unittest.TestCase):
         mocker.add_matcher(MockMatcher("added_matcher1"))
         self.assertEqual(str(mocker), "invocation_matcher: added_matcher1")
 
+    def test_frozen_matches_with_custom_matchers(self):
+        mocker = pmock.InvocationMocker(pmock.OnceInvocationMatcher())
+        mocker.add_matcher(pmock.MethodMatcher("duck"))
+        mocker.add_matcher(self.MockMatcher(False))
+        mocker.freeze("duck")
+        self.assert_(not mocker.matches(pmock.Invocation("duck", (), {})))
+
+    def test_frozen_checks_other_method_names(self):
+        mocker = pmock.InvocationMocker(pmock.OnceInvocationMatcher())
+        mocker.add_matcher(pmock.MethodMatcher("duck"))
+        mocker.freeze()
+        self.assert_(not mocker.matches(pmock.Invocation("goose", (), {})))
+        self.assert_(mocker.matches(pmock.Invocation("duck", (), {})))
+
+    def test_frozen_invokes_and_verifies_stateful_matchers(self):
+        mocker = pmock.InvocationMocker(pmock.OnceInvocationMatcher())
+        mocker.add_matcher(pmock.MethodMatcher("duck"))
+        class MockMatcher(self.MockMatcher):
+            def verify(self): pass
+        matcher = MockMatcher(True)
+        mocker.add_matcher(matcher)
+        mocker.freeze("duck")
+        self.assertRaises(pmock.VerificationError, mocker.verify)
+        invocation = pmock.Invocation("duck", (), {})
+        mocker.invoke(invocation)
+        self.assertEqual(matcher.invoked_invocation, invocation)
+        self.assert_(not mocker.matches(invocation))
+        mocker.verify()
+
+    def test_add_matcher_to_frozen_raises(self):
+        mocker = pmock.InvocationMocker(pmock.OnceInvocationMatcher())
+        mocker.freeze()
+        try:
+            mocker.add_matcher(pmock.MethodMatcher("duck"))
+            self.fail("expected add_matcher to raise")
+        except pmock.DefinitionError, err:
+            self.assertEqual(err.msg,
+                             "expectation expected once:  is frozen")
+
+    def test_exhausted_when_invocation_matcher_exhausted(self):
+        class MockMatcher:
+            def __init__(self, exhausted): self._exhausted = exhausted
+            def is_exhausted(self): return self._exhausted
+        self.assert_(pmock.InvocationMocker(MockMatcher(True)).is_exhausted())
+        self.assert_(
+            not pmock.InvocationMocker(MockMatcher(False)).is_exhausted())
+
+    def test_records_invocation_sequence(self):
+        mocker = pmock.InvocationMocker(self.MockMatcher(True))
+        self.assert_(mocker.get_first_sequence() is None)
+        self.assert_(mocker.get_last_sequence() is None)
+        first = pmock.Invocation("duck", (), {})
+        second = pmock.Invocation("duck", (), {})
+        mocker.invoke(first)
+        mocker.invoke(second)
+        self.assertEqual(mocker.get_first_sequence(), first.sequence)
+        self.assertEqual(mocker.get_last_sequence(), second.sequence)
+
+    def test_claims_invocation_sequences_out_of_order(self):
+        mocker = pmock.InvocationMocker(self.MockMatcher(True))
+        first = pmock.Invocation("duck", (), {})
+        second = pmock.Invocation("duck", (), {})
+        mocker.claim(second)
+        mocker.claim(first)
+        self.assertEqual(mocker.get_first_sequence(), first.sequence)
+        self.assertEqual(mocker.get_last_sequence(), second.sequence)
+
+    def test_claim_records_matched_invocation_without_stub(self):
+        class MockStub:
+            invoked = False
+            def invoke(self, invocation): self.invoked = True
+        matcher = self.MockMatcher(True)
+        stub = MockStub()
+        mocker = pmock.InvocationMocker(matcher)
+        mocker.set_stub(stub)
+        invocation = pmock.Invocation("duck", (), {})
+        self.assert_(mocker.claim(invocation))
+        self.assertEqual(matcher.invoked_invocation, invocation)
+        self.assertEqual(mocker.get_first_sequence(), invocation.sequence)
+        self.assert_(not stub.invoked)
+
+    def test_claim_unmatched(self):
+        matcher = self.MockMatcher(False)
+        mocker = pmock.InvocationMocker(matcher)
+        self.assert_(not mocker.claim(pmock.Invocation("duck", (), {})))
+        self.assert_(not hasattr(matcher, "invoked_invocation"))
+        self.assert_(mocker.get_first_sequence() is None)
+
+    def test_invoke_stub(self):
+        class MockStub:
+            def invoke(self, invocation): return invocation.name
+        mocker = pmock.InvocationMocker(self.MockMatcher(True))
+        self.assert_(mocker.invoke_stub(pmock.Invocation("duck", (), {}))
+                     is None)
+        mocker.set_stub(MockStub())
+        self.assertEqual(
+            mocker.invoke_stub(pmock.Invocation("duck", (), {})), "duck")
+
+    def test_not_exhausted_without_exhaustion_check(self):
+        mocker = pmock.InvocationMocker(self.MockMatcher(True))
+        self.assert_(not mocker.is_exhausted())
+
+    def test_satisfied_when_matchers_satisfied(self):
+        mocker = pmock.InvocationMocker(pmock.OnceInvocationMatcher())
+        mocker.add_matcher(pmock.MethodMatcher("duck"))
+        self.assert_(not mocker.is_satisfied())
+        mocker.invoke(pmock.Invocation("duck", (), {}))
+        self.assert_(mocker.is_satisfied())
+
+    def test_not_satisfied_without_satisfaction_check(self):
+        mocker = pmock.InvocationMocker(pmock.StubInvocationMatcher())
+        mocker.add_matcher(self.MockMatcher(True))
+        self.assert_(not mocker.is_satisfied())
+
     def test_id_str(self):
         class MockMatcher:
             def __init__(self, str_str): self._str = str_str
@@ -280,10 +511,17 @@ class InvocationMockerBuilderTest(testsupport.ErrorMsgAssertsMixin,
             self.stub = None
         def add_matcher(self, matcher):
             self.added_matchers.append(matcher)
+        def check_definable(self):
+            pass
         def set_id(self, mocker_id):
             self.id = mocker_id
         def set_stub(self, stub):
             self.stub = stub
+        def has_arguments_matcher(self):
+            for matcher in self.added_matchers:
+                if isinstance(matcher, pmock.AbstractArgumentsMatcher):
+                    return True
+            return False
         def _get_only_added_matcher(self):
             if len(self.added_matchers) != 1:
                 raise AssertionError('more than one matcher has been added')
@@ -377,6 +615,25 @@ class InvocationMockerBuilderTest(testsupport.ErrorMsgAssertsMixin,
         self.assert_(isinstance(self.mocker.added_matcher,
                                 pmock.InvokedAfterMatcher))
 
+    def test_add_second_after_ordering(self):
+        for builder_id in ("rooster", "hen"):
+            builder = pmock.InvocationMockerBuilder(
+                self.MockInvocationMocker(), self.builder_namespace)
+            builder.id(builder_id)
+        self.builder.after("rooster").after("hen")
+        self.assertEqual(str(self.mocker.added_matcher),
+                         ".after('rooster').after('hen')")
+
+    def test_after_shares_predecessor_recorder(self):
+        mock = pmock.Mock()
+        mock.expects(pmock.once()).method("rooster")
+        mock.expects(pmock.once()).method("hen").after("rooster")
+        mock.expects(pmock.once()).method("chick").after("rooster")
+        predecessor = mock.lookup_id("rooster")._mocker
+        recorders = [matcher for matcher in predecessor._matchers
+                     if isinstance(matcher, pmock.PredecessorRecorderMatcher)]
+        self.assertEqual(len(recorders), 1)
+
     def test_after_undefined_id(self):
         try:
             self.builder.after("rooster")
@@ -408,6 +665,56 @@ class InvocationMockerBuilderTest(testsupport.ErrorMsgAssertsMixin,
         self.assert_(self.builder.match(custom_matcher) is not None)
         self.assertEqual(self.mocker.added_matcher, custom_matcher)
 
+    def test_from_table(self):
+        self.assert_(self.builder.from_table({"egg": "chick"}) is not None)
+        self.assert_(isinstance(self.mocker.added_matcher,
+                                pmock.TableArgumentsMatcher))
+        self.assert_(isinstance(self.mocker.stub, pmock.LookupStub))
+        self.assertEqual(
+            self.mocker.stub.invoke(pmock.Invocation("hen", ("egg",), {})),
+            "chick")
+
+    def test_from_table_after_arguments(self):
+        self.builder.taking(pmock.eq("egg"))
+        self.assertRaises(pmock.DefinitionError, self.builder.from_table,
+                          {"egg": "chick"})
+
+
+class TableArgumentsMatcherTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = pmock.TableArgumentsMatcher(
+            {"egg": "chick", ("egg", 2): "chicks"})
+
+    def test_matches_single_argument_key(self):
+        self.assert_(self.matcher.matches(
+            pmock.Invocation("hatch", ("egg",), {})))
+
+    def test_matches_argument_tuple_key(self):
+        self.assert_(self.matcher.matches(
+            pmock.Invocation("hatch", ("egg", 2), {})))
+
+    def test_unmatched_key(self):
+        self.assert_(not self.matcher.matches(
+            pmock.Invocation("hatch", ("stone",), {})))
+        self.assert_(not self.matcher.matches(
+            pmock.Invocation("hatch", (), {})))
+
+    def test_unmatched_tuple_argument(self):
+        self.assert_(not self.matcher.matches(
+            pmock.Invocation("hatch", (("egg", 2),), {})))
+
+    def test_unmatched_keyword_arguments(self):
+        self.assert_(not self.matcher.matches(
+            pmock.Invocation("hatch", ("egg",), {"warm": True})))
+
+    def test_unmatched_unhashable_argument(self):
+        self.assert_(not self.matcher.matches(
+            pmock.Invocation("hatch", (["egg"],), {})))
+
+    def test_str(self):
+        self.assertEqual(str(self.matcher), "(key of table)")
+
 
 class MethodMatcherTest(unittest.TestCase):
 
@@ -444,6 +751,50 @@ class InvokedAfterMatcherTest(unittest.TestCase):
     def test_str(self):
         self.assertEqual(str(self.matcher), ".after('weasel')")
 
+    def test_notifying_predecessors_counted_down(self):
+        recorder1 = pmock.PredecessorRecorderMatcher()
+        recorder2 = pmock.PredecessorRecorderMatcher()
+        matcher = pmock.InvokedAfterMatcher(recorder1, "'weasel'")
+        matcher.add_predecessor(recorder2, "'ferret'")
+        self.assertEqual(str(matcher), ".after('weasel').after('ferret')")
+        recorder1.invoked(self.invocation)
+        recorder1.invoked(self.invocation)
+        self.assert_(not matcher.matches(self.invocation))
+        recorder2.invoked(self.invocation)
+        self.assert_(matcher.matches(self.invocation))
+
+    def test_invoked_predecessor_added(self):
+        recorder = pmock.PredecessorRecorderMatcher()
+        recorder.invoked(self.invocation)
+        matcher = pmock.InvokedAfterMatcher(recorder, "'weasel'")
+        self.assert_(matcher.matches(self.invocation))
+
+    def test_polled_and_notifying_predecessors(self):
+        recorder = pmock.PredecessorRecorderMatcher()
+        self.matcher.add_predecessor(recorder, "'ferret'")
+        recorder.invoked(self.invocation)
+        self.assert_(not self.matcher.matches(self.invocation))
+        self.invocation_recorder.invoked(self.invocation)
+        self.assert_(self.matcher.matches(self.invocation))
+
+
+class PredecessorRecorderMatcherTest(unittest.TestCase):
+
+    def test_notifies_successors_when_first_invoked(self):
+        class AfterMatcher:
+            notifications = 0
+            def predecessor_invoked(self): self.notifications += 1
+        after_matcher = AfterMatcher()
+        recorder = pmock.PredecessorRecorderMatcher()
+        recorder.add_successor(after_matcher)
+        invocation = pmock.Invocation("stoat", (), {})
+        self.assert_(recorder.matches(invocation))
+        recorder.invoked(invocation)
+        recorder.invoked(invocation)
+        self.assertEqual(after_matcher.notifications, 1)
+        self.assertEqual(recorder.get_invocation_count(), 2)
+        recorder.verify()
+
 
 class InvocationTest(unittest.TestCase):
 
@@ -465,6 +816,11 @@ class InvocationTest(unittest.TestCase):
                                  {"home": "iceberg", "food": "fish"})),
             "penguin('swim', 'waddle', food='fish', home='iceberg')")
 
+    def test_sequence_increases(self):
+        first = pmock.Invocation("penguin", (), {})
+        second = pmock.Invocation("puffin", (), {})
+        self.assert_(first.sequence < second.sequence)
+
 
 class ProxyTest(unittest.TestCase):
 
@@ -479,6 +835,513 @@ class ProxyTest(unittest.TestCase):
         self.assertEqual(mock.invocation.args, ("walk",))
         self.assertEqual(mock.invocation.kwargs, {"desert": "gobi"})        
 
+    def test_bound_method_reused(self):
+        proxy = pmock.Proxy(pmock.Mock())
+        self.assert_(proxy.camel is proxy.camel)
+        self.assert_(proxy.camel is not proxy.llama)
+        self.assert_(isinstance(proxy.verify, pmock.BoundMethod))
+
+
+class InvokableIndexTest(unittest.TestCase):
+
+    class Invokable:
+        def __init__(self, matches=True, exhausted=False):
+            self._matches = matches
+            self._exhausted = exhausted
+            self.match_attempts = 0
+        def matches(self, invocation):
+            self.match_attempts += 1
+            return self._matches
+        def is_exhausted(self):
+            return self._exhausted
+
+    def setUp(self):
+        self.index = pmock.InvokableIndex()
+
+    def find_match(self, name):
+        return self.index.find_match(pmock.Invocation(name, (), {}))
+
+    def test_empty(self):
+        self.assert_(self.find_match("wolf") is None)
+
+    def test_unnamed_matched_for_every_name(self):
+        invokable = self.Invokable()
+        self.index.add(invokable)
+        self.assert_(self.find_match("wolf") is invokable)
+        self.assert_(self.find_match("fox") is invokable)
+
+    def test_named_only_matched_for_name(self):
+        invokable = self.Invokable()
+        self.index.add(invokable)
+        self.index.index_method_name("wolf", invokable)
+        self.assert_(self.find_match("wolf") is invokable)
+        self.assert_(self.find_match("fox") is None)
+
+    def test_lifo_order_across_named_and_unnamed(self):
+        howl = self.Invokable(False)
+        bark = self.Invokable()
+        growl = self.Invokable()
+        yelp = self.Invokable(False)
+        for invokable in [howl, bark, growl, yelp]:
+            self.index.add(invokable)
+        self.index.index_method_name("wolf", bark)
+        self.index.index_method_name("wolf", howl)
+        self.index.index_method_name("fox", growl)
+        self.assert_(self.find_match("wolf") is bark)
+        self.assertEqual(howl.match_attempts, 0)
+        self.assertEqual(growl.match_attempts, 0)
+        self.assert_(self.find_match("fox") is growl)
+        self.assertEqual(yelp.match_attempts, 2)
+
+    def test_index_unknown_invokable_ignored(self):
+        self.index.index_method_name("wolf", self.Invokable())
+        self.assert_(self.find_match("wolf") is None)
+
+    def test_first_indexed_name_kept(self):
+        invokable = self.Invokable()
+        self.index.add(invokable)
+        self.index.index_method_name("wolf", invokable)
+        self.index.index_method_name("fox", invokable)
+        self.assert_(self.find_match("wolf") is invokable)
+        self.assert_(self.find_match("fox") is None)
+
+    def test_exhausted_invokable_retired(self):
+        exhausted = self.Invokable(False, True)
+        self.index.add(exhausted)
+        self.index.index_method_name("wolf", exhausted)
+        self.assert_(self.find_match("wolf") is None)
+        self.assert_(self.find_match("wolf") is None)
+        self.assertEqual(exhausted.match_attempts, 1)
+
+    def test_keyed_only_matched_for_arguments(self):
+        invokable = self.Invokable()
+        self.index.add(invokable)
+        self.index.index_method_name("wolf", invokable)
+        self.index.index_lookup_key(pmock._lookup_key(("moon",), {}),
+                                    invokable)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("moon",), {})) is invokable)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("sun",), {})) is None)
+        self.assertEqual(invokable.match_attempts, 1)
+
+    def test_keyed_tried_for_unhashable_arguments(self):
+        invokable = self.Invokable()
+        self.index.add(invokable)
+        self.index.index_method_name("wolf", invokable)
+        self.index.index_lookup_key(pmock._lookup_key(("moon",), {}),
+                                    invokable)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", (["moon"],), {})) is invokable)
+
+    def test_lifo_order_across_keyed_and_unkeyed(self):
+        howl = self.Invokable()
+        bark = self.Invokable(False)
+        growl = self.Invokable()
+        key = pmock._lookup_key(("moon",), {})
+        for invokable in [howl, bark, growl]:
+            self.index.add(invokable)
+            self.index.index_method_name("wolf", invokable)
+        self.index.index_lookup_key(key, howl)
+        self.index.index_lookup_key(key, growl)
+        moon_invocation = pmock.Invocation("wolf", ("moon",), {})
+        self.assert_(self.index.find_match(moon_invocation) is growl)
+        self.assertEqual(bark.match_attempts, 0)
+        growl._matches = False
+        self.assert_(self.index.find_match(moon_invocation) is howl)
+        self.assertEqual(bark.match_attempts, 1)
+
+    def test_add_indexed(self):
+        key = pmock._lookup_key(("moon",), {})
+        howl = self.Invokable()
+        growl = self.Invokable()
+        self.index.add_indexed(howl, "wolf", key)
+        self.index.add_indexed(growl, "wolf", None)
+        self.assertEqual(self.index.method_name(howl), "wolf")
+        self.assert_(self.find_match("dog") is None)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("moon",), {})) is growl)
+        growl._matches = False
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("moon",), {})) is howl)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("sun",), {})) is None)
+
+    def test_exhausted_keyed_invokable_retired(self):
+        exhausted = self.Invokable(False, True)
+        self.index.add(exhausted)
+        self.index.index_method_name("wolf", exhausted)
+        self.index.index_lookup_key(pmock._lookup_key(("moon",), {}),
+                                    exhausted)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", ("moon",), {})) is None)
+        self.assert_(self.index.find_match(
+            pmock.Invocation("wolf", (["moon"],), {})) is None)
+        self.assertEqual(exhausted.match_attempts, 1)
+
+    def test_invokable_without_exhaustion_kept(self):
+        class Invokable:
+            def matches(self, invocation): return False
+        self.index.add(Invokable())
+        self.assert_(self.find_match("wolf") is None)
+
+    def test_concurrent_finds_scan_unchanged_buckets(self):
+        self.index.allow_concurrent_finds(threading.Lock())
+        exhausted = self.Invokable(False, True)
+        howl = self.Invokable()
+        self.index.add(howl)
+        self.index.index_method_name("wolf", howl)
+        self.index.add(exhausted)
+        self.index.index_method_name("wolf", exhausted)
+        scanned_bucket = self.index._named["wolf"]
+        self.assert_(self.find_match("wolf") is howl)
+        self.assertEqual([entry[1] for entry in scanned_bucket],
+                         [howl, exhausted])
+        self.assertEqual(exhausted.match_attempts, 1)
+        self.assert_(self.find_match("wolf") is howl)
+        self.assertEqual(exhausted.match_attempts, 1)
+
+    def test_entry_retired_by_another_find_ignored(self):
+        self.index.allow_concurrent_finds(threading.Lock())
+        exhausted = self.Invokable(False, True)
+        self.index.add_indexed(exhausted, "wolf", None)
+        entry = self.index._named["wolf"][0]
+        self.index._retire(entry)
+        self.index._retire(entry)
+        self.assertEqual(self.index._named["wolf"], [])
+
+
+class FifoDispatcherTest(unittest.TestCase):
+
+    class Invokable:
+        def __init__(self, matches=True, exhausted=False, satisfied=False):
+            self._matches = matches
+            self.exhausted = exhausted
+            self.satisfied = satisfied
+            self.match_attempts = 0
+        def matches(self, invocation):
+            self.match_attempts += 1
+            return self._matches
+        def is_exhausted(self):
+            return self.exhausted
+        def is_satisfied(self):
+            return self.satisfied
+
+    def setUp(self):
+        self.dispatcher = pmock.FifoDispatcher()
+
+    def find_match(self, name):
+        return self.dispatcher.find_match(pmock.Invocation(name, (), {}))
+
+    def test_empty(self):
+        self.assert_(self.find_match("wolf") is None)
+
+    def test_only_head_tried(self):
+        head = self.Invokable(matches=False)
+        second = self.Invokable()
+        self.dispatcher.add(head)
+        self.dispatcher.add(second)
+        self.assert_(self.find_match("wolf") is None)
+        self.assertEqual(second.match_attempts, 0)
+
+    def test_exhausted_head_dropped(self):
+        head = self.Invokable()
+        second = self.Invokable()
+        self.dispatcher.add(head)
+        self.dispatcher.add(second)
+        self.assert_(self.find_match("wolf") is head)
+        head._matches = False
+        head.exhausted = True
+        self.assert_(self.find_match("wolf") is second)
+        self.assert_(self.find_match("wolf") is second)
+        self.assertEqual(head.match_attempts, 2)
+
+    def test_satisfied_head_dropped_when_unmatched(self):
+        head = self.Invokable(matches=False)
+        second = self.Invokable()
+        self.dispatcher.add(head)
+        self.dispatcher.add(second)
+        head.satisfied = True
+        self.assert_(self.find_match("wolf") is second)
+
+    def test_satisfied_invokables_matched_lifo_behind_queue(self):
+        head = self.Invokable(matches=False)
+        stub1 = self.Invokable(satisfied=True)
+        stub2 = self.Invokable(satisfied=True)
+        self.dispatcher.add(stub1)
+        self.dispatcher.add(head)
+        self.dispatcher.add(stub2)
+        self.assert_(self.find_match("wolf") is stub2)
+        self.assertEqual(head.match_attempts, 1)
+        self.assertEqual(stub1.match_attempts, 0)
+
+    def test_add_indexed(self):
+        queued = self.Invokable()
+        stub = self.Invokable(satisfied=True)
+        self.dispatcher.add_indexed(queued, "howl", None)
+        self.dispatcher.add_indexed(stub, "bark", None)
+        self.assert_(self.dispatcher.method_name(queued) is None)
+        self.assertEqual(self.dispatcher.method_name(stub), "bark")
+        self.assert_(self.find_match("bark") is queued)
+        queued.satisfied = True
+        queued._matches = False
+        self.assert_(self.find_match("bark") is stub)
+        self.assert_(self.find_match("howl") is None)
+
+    def test_method_name(self):
+        queued = self.Invokable()
+        stub = self.Invokable(satisfied=True)
+        self.dispatcher.add(queued)
+        self.dispatcher.add(stub)
+        self.dispatcher.index_method_name("howl", queued)
+        self.dispatcher.index_method_name("bark", stub)
+        self.assert_(self.dispatcher.method_name(queued) is None)
+        self.assertEqual(self.dispatcher.method_name(stub), "bark")
+        self.assert_(self.find_match("howl") is queued)
+
+    def test_frozen_head_checks_method_name(self):
+        mock = pmock.Mock(dispatcher=self.dispatcher)
+        mock.expects(pmock.once()).open().will(pmock.return_value(1))
+        mock.expects(pmock.once()).close()
+        mock.freeze()
+        self.assertRaises(pmock.MatchError, mock.close)
+        self.assertEqual(mock.open(), 1)
+        mock.close()
+        mock.verify()
+
+    def test_head_dropped_by_another_find_kept(self):
+        self.dispatcher.allow_concurrent_finds(threading.Lock())
+        head = self.Invokable(exhausted=True)
+        second = self.Invokable()
+        self.dispatcher.add(head)
+        self.dispatcher.add(second)
+        self.dispatcher._queue.popleft()
+        self.dispatcher._drop_head(head)
+        self.assert_(self.find_match("wolf") is second)
+
+    def test_verify_order(self):
+        entries = [(1, "b"), (0, "a"), (2, "c")]
+        self.dispatcher.verify_order(entries)
+        self.assertEqual(entries, [(0, "a"), (1, "b"), (2, "c")])
+        pmock.InvokableIndex().verify_order(entries)
+        self.assertEqual(entries, [(2, "c"), (1, "b"), (0, "a")])
+
+
+class InvocationLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.log = pmock.InvocationLog()
+        self.invocations = [pmock.Invocation("write", ("abc",), {}),
+                            pmock.Invocation("seek", (0,), {"whence": 2}),
+                            pmock.Invocation("write", ("de",), {})]
+        for invocation in self.invocations:
+            self.log.record(invocation)
+
+    def assertInvocations(self, invocations, expected):
+        self.assertEqual([(i.name, i.args, i.kwargs, i.sequence)
+                          for i in invocations],
+                         [(i.name, i.args, i.kwargs, i.sequence)
+                          for i in expected])
+
+    def test_empty(self):
+        log = pmock.InvocationLog()
+        self.assertEqual(len(log), 0)
+        self.assertEqual(log.count("write"), 0)
+        self.assertEqual(log.select(), [])
+        self.assertEqual(log.select("write"), [])
+
+    def test_count(self):
+        self.assertEqual(len(self.log), 3)
+        self.assertEqual(self.log.count(), 3)
+        self.assertEqual(self.log.count("write"), 2)
+        self.assertEqual(self.log.count("seek"), 1)
+        self.assertEqual(self.log.count("close"), 0)
+
+    def test_method_names(self):
+        self.assertEqual(self.log.get_method_names(), ["write", "seek"])
+
+    def test_select_all(self):
+        self.assertInvocations(self.log.select(), self.invocations)
+
+    def test_select_by_name(self):
+        self.assertInvocations(self.log.select("write"),
+                               [self.invocations[0], self.invocations[2]])
+
+    def test_recent(self):
+        self.assertInvocations(self.log.recent(2), self.invocations[1:])
+        self.assertInvocations(self.log.recent(10), self.invocations)
+        self.assertInvocations(
+            self.log.recent(1, self.invocations[1].sequence),
+            self.invocations[1:2])
+
+    def test_invalid_arguments(self):
+        self.assertRaises(ValueError, pmock.InvocationLog, capacity=0)
+        self.assertRaises(ValueError, pmock.InvocationLog, sample_every=0)
+
+    def test_capacity_keeps_latest_records(self):
+        log = pmock.InvocationLog(capacity=3)
+        invocations = [pmock.Invocation(name, (i,), {})
+                       for i, name in enumerate("abaabbab")]
+        for invocation in invocations:
+            log.record(invocation)
+        self.assertEqual(len(log), 3)
+        self.assertEqual(log.count(), 8)
+        self.assertEqual(log.count("a"), 4)
+        self.assertInvocations(log.select(), invocations[-3:])
+        self.assertInvocations(log.select("a"), [invocations[-2]])
+        self.assertInvocations(log.select("b", pmock.eq(7)),
+                               [invocations[-1]])
+        self.assertInvocations(log.recent(2), invocations[-2:])
+
+    def test_capacity_index_stays_bounded(self):
+        log = pmock.InvocationLog(capacity=10)
+        for i in xrange(1000):
+            log.record(pmock.Invocation("a", (i,), {}))
+        self.assertEqual([invocation.args[0]
+                          for invocation in log.select("a")],
+                         range(990, 1000))
+        self.assert_(len(log._records_by_name_id[0]) <= 20)
+
+    def test_sampling_records_one_in_n_calls_to_each_method(self):
+        log = pmock.InvocationLog(sample_every=3)
+        for i in xrange(7):
+            log.record(pmock.Invocation("a", (i,), {}))
+        log.record(pmock.Invocation("b", (), {}))
+        self.assertEqual(log.count("a"), 7)
+        self.assertEqual(log.count("b"), 1)
+        self.assertEqual([(invocation.name, invocation.args)
+                          for invocation in log.select()],
+                         [("a", (0,)), ("a", (3,)), ("a", (6,)), ("b", ())])
+
+    def test_capture_policy(self):
+        class Capture:
+            def capture(self, value): return ("captured", value)
+            def restore(self, captured): return captured[1]
+        log = pmock.InvocationLog(capture=Capture())
+        log.record(pmock.Invocation("write", ("abc",), {"flush": True}))
+        self.assertEqual(log._args_column[0], (("captured", "abc"),))
+        self.assertEqual(str(log.select()[0]), "write('abc', flush=True)")
+        self.assertEqual(len(log.select("write", pmock.eq("abc"),
+                                        flush=pmock.eq(True))), 1)
+
+    def test_select_by_constraints(self):
+        self.assertInvocations(
+            self.log.select("write", pmock.functor(lambda data:
+                                                   len(data) > 2)),
+            [self.invocations[0]])
+        self.assertInvocations(self.log.select(None, whence=pmock.eq(2)),
+                               [self.invocations[1]])
+        self.assertEqual(self.log.select("seek", pmock.eq(0), pmock.eq(1)),
+                         [])
+
+    def test_select_by_keyword_called_name(self):
+        log = pmock.InvocationLog()
+        log.record(pmock.Invocation("open", (), {"name": "x"}))
+        log.record(pmock.Invocation("open", (), {"name": "y"}))
+        self.assertEqual(
+            [i.kwargs for i in log.select("open", name=pmock.eq("x"))],
+            [{"name": "x"}])
+        self.assertEqual(
+            [i.kwargs for i in log.select(None, name=pmock.eq("y"))],
+            [{"name": "y"}])
+
+
+class WeakReferenceCaptureTest(unittest.TestCase):
+
+    class Buffer(object):
+        pass
+
+    def setUp(self):
+        self.capture = pmock.WeakReferenceCapture()
+
+    def test_restores_live_argument(self):
+        buf = self.Buffer()
+        captured = self.capture.capture(buf)
+        self.assert_(self.capture.restore(captured) is buf)
+
+    def test_doesnt_keep_argument_alive(self):
+        captured = self.capture.capture(self.Buffer())
+        restored = self.capture.restore(captured)
+        self.assert_(isinstance(restored, pmock.CollectedArgument))
+        self.assertEqual(repr(restored), "<collected Buffer>")
+
+    def test_fingerprints_unreferenceable_arguments(self):
+        for value in ("data", (1, 2), [3], {"a": 4}, bytearray("data")):
+            restored = self.capture.restore(self.capture.capture(value))
+            self.assert_(isinstance(restored, pmock.Fingerprint))
+            self.assertEqual(restored, value)
+
+    def test_keeps_scalars(self):
+        for value in (3, 1.5, None):
+            captured = self.capture.capture(value)
+            self.assert_(captured is value)
+            self.assert_(self.capture.restore(captured) is value)
+
+    def test_fallback(self):
+        capture = pmock.WeakReferenceCapture(pmock.TruncatedReprCapture(5))
+        restored = capture.restore(capture.capture("abcdefgh"))
+        self.assertEqual(repr(restored), "'abcd...")
+
+
+class FingerprintCaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.capture = pmock.FingerprintCapture()
+
+    def test_equal_to_same_contents(self):
+        captured = self.capture.capture("x" * 1000)
+        self.assert_(isinstance(captured, pmock.Fingerprint))
+        self.assertEqual(captured, "x" * 1000)
+        self.assert_("x" * 1000 == captured)
+        self.assertNotEqual(captured, "y" * 1000)
+        self.assertNotEqual(captured, u"x" * 1000)
+        self.assertEqual(captured, self.capture.capture("x" * 1000))
+        self.assertEqual(self.capture.capture(u"\xe9"), u"\xe9")
+
+    def test_fingerprints_buffers_and_other_objects(self):
+        self.assertEqual(self.capture.capture(bytearray("data")),
+                         bytearray("data"))
+        self.assertEqual(self.capture.capture([1, 2]), [1, 2])
+        self.assertNotEqual(self.capture.capture([1, 2]), [1, 3])
+
+    def test_fingerprints_container_items(self):
+        self.assertNotEqual(self.capture.capture(range(10000)),
+                            range(9999) + [-1])
+        self.assertNotEqual(self.capture.capture(["ab", "c"]), ["a", "bc"])
+        self.assertNotEqual(self.capture.capture([1]), ["1"])
+        self.assertEqual(self.capture.capture({"a": [1], "b": (2,)}),
+                         {"b": (2,), "a": [1]})
+        self.assertNotEqual(self.capture.capture({"a": 1}), {"a": 2})
+        self.assertEqual(self.capture.capture(set([3, 1, 2])),
+                         set([1, 2, 3]))
+        cycle = []
+        cycle.append(cycle)
+        self.assertEqual(self.capture.capture(cycle), cycle)
+
+    def test_repr(self):
+        self.assertEqual(repr(self.capture.capture("abc")),
+                         "<str sha1:a9993e364706>")
+
+    def test_keeps_scalars(self):
+        for value in (3, 3L, 1.5, True, None):
+            self.assert_(self.capture.capture(value) is value)
+
+
+class TruncatedReprCaptureTest(unittest.TestCase):
+
+    def test_truncates_repr(self):
+        capture = pmock.TruncatedReprCapture(max_length=5)
+        captured = capture.capture("abcdefgh")
+        self.assertEqual(repr(captured), "'abcd...")
+        self.assertEqual(captured, "abcdxyz")
+        self.assertNotEqual(captured, "abxyz")
+        self.assertEqual(repr(capture.capture("ab")), "'ab'")
+
+    def test_keeps_scalars(self):
+        capture = pmock.TruncatedReprCapture()
+        self.assert_(capture.capture(None) is None)
+        self.assertEqual(capture.capture(10 ** 100), 10 ** 100)
+
 
 class MockTest(unittest.TestCase):
 
@@ -562,6 +1425,90 @@ class MockTest(unittest.TestCase):
             self.assert_(invokable1.verified)
             self.assert_(invokable2.verified)
             self.assert_(not invokable3.verified)
+
+    class SatisfiableInvokable:
+        def __init__(self, satisfied):
+            self.satisfied = satisfied
+            self.verify_count = 0
+        def matches(self, invocation): return True
+        def invoke(self, invocation): self.satisfied = True
+        def is_satisfied(self): return self.satisfied
+        def verify(self):
+            self.verify_count += 1
+            if not self.satisfied:
+                raise pmock.VerificationError("problem")
+
+    def test_verify_skips_satisfied_invokables(self):
+        invokable = self.SatisfiableInvokable(True)
+        mock = pmock.Mock()
+        mock.add_invokable(invokable)
+        mock.verify()
+        mock.verify()
+        self.assertEqual(invokable.verify_count, 0)
+
+    def test_invoke_satisfies_invokable(self):
+        invokable = self.SatisfiableInvokable(False)
+        mock = pmock.Mock()
+        mock.add_invokable(invokable)
+        self.assert_(not mock.is_satisfied())
+        mock.howl()
+        self.assert_(mock.is_satisfied())
+        mock.verify()
+        self.assertEqual(invokable.verify_count, 1)
+
+    def test_invokables_without_satisfaction_check_always_verified(self):
+        class Invokable:
+            verify_count = 0
+            def verify(self): self.verify_count += 1
+        invokable = Invokable()
+        mock = pmock.Mock()
+        mock.add_invokable(invokable)
+        self.assert_(mock.is_satisfied())
+        mock.verify()
+        self.assertEqual(invokable.verify_count, 2)
+
+    def test_matcher_failing_after_more_calls_is_verified_again(self):
+        class AtMostTwice:
+            def __init__(self): self.count = 0
+            def matches(self, invocation): return True
+            def invoked(self, invocation): self.count += 1
+            def verify(self):
+                if self.count > 2:
+                    raise AssertionError("called more than twice")
+        mock = pmock.Mock()
+        mock.expects(AtMostTwice()).foo()
+        mock.foo()
+        mock.verify()
+        mock.foo()
+        mock.foo()
+        self.assert_(not mock.is_satisfied())
+        self.assertRaises(pmock.VerificationError, mock.verify)
+
+    def test_subclass_overriding_verify_only_is_verified(self):
+        class MyOnce(pmock.InvokedRecorderMatcher):
+            def verify(self):
+                if not self.has_been_invoked():
+                    raise AssertionError("my method was not invoked")
+        class MyOnceWithMessage(pmock.OnceInvocationMatcher):
+            def verify(self):
+                raise AssertionError("never good enough")
+        for matcher in [MyOnce(), MyOnceWithMessage()]:
+            mock = pmock.Mock()
+            mock.expects(matcher).foo()
+            self.assert_(not mock.is_satisfied())
+            self.assertRaises(pmock.VerificationError, mock.verify)
+
+    def test_added_matcher_unsatisfies_invokable(self):
+        class MockMatcher:
+            def matches(self, invocation): return True
+            def invoked(self, invocation): pass
+            def verify(self): raise AssertionError("problem")
+        mock = pmock.Mock()
+        builder = mock.stubs().method("howl")
+        mock.howl()
+        mock.verify()
+        builder.match(MockMatcher())
+        self.assertRaises(pmock.VerificationError, mock.verify)
         
     def test_invokables_str(self):
         class Invokable:
@@ -618,6 +1565,351 @@ class MockTest(unittest.TestCase):
         self.assertEqual(invokable.invocation.name, "howl")
         self.assertEqual(invokable.invocation.kwargs['under'], "moon")
 
+    def test_frozen_mock_disallows_definitions(self):
+        mock = pmock.Mock("wolf")
+        mock.freeze()
+        try:
+            mock.expects(pmock.once())
+            self.fail("expected definition to raise")
+        except pmock.DefinitionError, err:
+            self.assertEqual(err.msg, "mock 'wolf' is frozen")
+        self.assertRaises(pmock.DefinitionError, mock.stubs)
+
+    def test_freeze_freezes_invokables(self):
+        class Invokable:
+            def freeze(self, method_name):
+                self.frozen_method_name = method_name
+        named = Invokable()
+        unnamed = Invokable()
+        mock = pmock.Mock()
+        mock.add_invokable(named)
+        mock.add_invokable(unnamed)
+        mock.index_method_name("howl", named)
+        mock.freeze()
+        self.assertEqual(named.frozen_method_name, "howl")
+        self.assert_(unnamed.frozen_method_name is None)
+
+    def test_freeze_on_invoke(self):
+        mock = pmock.Mock(freeze_on_invoke=True)
+        mock.stubs().method("howl")
+        mock.stubs().method("bark")
+        mock.howl()
+        self.assertRaises(pmock.DefinitionError, mock.stubs)
+        mock.bark()
+
+    def test_invocation_log_records_invocations(self):
+        log = pmock.InvocationLog()
+        mock = pmock.Mock(invocation_log=log)
+        mock.stubs().method("howl")
+        mock.howl("moon")
+        self.assertRaises(pmock.MatchError, mock.bark)
+        self.assertEqual([(i.name, i.args) for i in log.select()],
+                         [("howl", ("moon",)), ("bark", ())])
+
+    def test_bound_method_reused(self):
+        mock = pmock.Mock()
+        self.assert_(mock.howl is mock.howl)
+        self.assert_(mock.howl is not mock.bark)
+
+    def test_bound_methods_dont_shadow_mock_methods(self):
+        mock = pmock.Mock()
+        mock.set_default_stub(pmock.return_value(None))
+        mock.proxy().expects()
+        mock.proxy().stubs()
+        mock.proxy().verify()
+        self.assert_(not isinstance(mock.expects, pmock.BoundMethod))
+        self.assert_(not isinstance(mock.stubs, pmock.BoundMethod))
+        self.assert_(not isinstance(mock.verify, pmock.BoundMethod))
+
+    def test_invoke_only_tries_invokables_for_method_name(self):
+        class Invokable:
+            def __init__(self):
+                self.invocation = None
+            def matches(self, invocation):
+                self.invocation = invocation
+                return True
+            def invoke(self, invocation): pass
+        mock = pmock.Mock()
+        howl_invokable = Invokable()
+        bark_invokable = Invokable()
+        mock.add_invokable(howl_invokable)
+        mock.add_invokable(bark_invokable)
+        mock.index_method_name("howl", howl_invokable)
+        mock.index_method_name("bark", bark_invokable)
+        mock.howl()
+        self.assertEqual(howl_invokable.invocation.name, "howl")
+        self.assert_(bark_invokable.invocation is None)
+
+
+class ThreadSafeMockTest(unittest.TestCase):
+
+    class Invokable:
+        def __init__(self, claims=True):
+            self._claims = claims
+            self.available = True
+            self.events = []
+        def matches(self, invocation):
+            self.events.append("matches")
+            return self.available
+        def claim(self, invocation):
+            self.events.append("claim")
+            # a claim failing as if another thread had used up the invokable
+            self.available = self._claims
+            return self._claims
+        def invoke_stub(self, invocation):
+            self.events.append("invoke_stub")
+            return "howl"
+
+    def test_claims_invokable_before_invoking_stub(self):
+        invokable = self.Invokable()
+        mock = pmock.ThreadSafeMock()
+        mock.add_invokable(invokable)
+        self.assertEqual(mock.invoke(pmock.Invocation("wolf", (), {})),
+                         "howl")
+        self.assertEqual(invokable.events,
+                         ["matches", "claim", "invoke_stub"])
+
+    def test_matches_again_after_failed_claim(self):
+        invokable = self.Invokable(claims=False)
+        mock = pmock.ThreadSafeMock()
+        mock.add_invokable(invokable)
+        try:
+            mock.invoke(pmock.Invocation("wolf", (), {}))
+            self.fail("should have raised due to unexpected method call")
+        except pmock.MatchError, err:
+            self.assert_(err.msg.startswith("no match found\n"))
+        self.assertEqual(invokable.events, ["matches", "claim", "matches"])
+
+    def test_claimed_expectation_is_satisfied(self):
+        mock = pmock.ThreadSafeMock()
+        mock.expects(pmock.once()).method("wolf")
+        self.assert_(not mock.is_satisfied())
+        mock.wolf()
+        self.assert_(mock.is_satisfied())
+        self.assertRaises(pmock.MatchError, mock.wolf)
+
+    def test_matches_without_mock_lock(self):
+        mock = pmock.ThreadSafeMock()
+        mock.stubs().method("wolf").will(pmock.return_value("howl"))
+        results = []
+        caller = threading.Thread(target=lambda: results.append(mock.wolf()))
+        mock._lock.acquire()
+        try:
+            caller.start()
+            caller.join(5)
+            self.assertEqual(results, ["howl"])
+        finally:
+            mock._lock.release()
+            caller.join()
+
+    def test_matches_under_mock_lock_without_concurrent_finds(self):
+        class Dispatcher:
+            def __init__(self):
+                self.invokables = []
+            def add(self, invokable):
+                self.invokables.append(invokable)
+            def find_match(self, invocation):
+                self.locked = mock._lock.locked()
+                return self.invokables[0]
+        dispatcher = Dispatcher()
+        mock = pmock.ThreadSafeMock(dispatcher=dispatcher)
+        mock.add_invokable(self.Invokable())
+        self.assertEqual(mock.invoke(pmock.Invocation("wolf", (), {})),
+                         "howl")
+        self.assert_(dispatcher.locked)
+
+    def test_records_invocations_in_log(self):
+        log = pmock.InvocationLog()
+        mock = pmock.ThreadSafeMock(invocation_log=log)
+        mock.stubs().method("wolf")
+        mock.wolf()
+        self.assertEqual(log.count("wolf"), 1)
+
+    def test_freeze_on_invoke(self):
+        mock = pmock.ThreadSafeMock(freeze_on_invoke=True)
+        mock.stubs().method("wolf")
+        mock.wolf()
+        self.assertRaises(pmock.DefinitionError, mock.stubs)
+
+    def test_wait_until_satisfied_when_already_satisfied(self):
+        mock = pmock.ThreadSafeMock()
+        mock.expects(pmock.once()).method("wolf")
+        mock.wolf()
+        mock.wait_until_satisfied(0)
+
+    def test_wait_until_satisfied_times_out(self):
+        mock = pmock.ThreadSafeMock()
+        mock.expects(pmock.once()).method("wolf")
+        self.assertRaises(pmock.VerificationError,
+                          mock.wait_until_satisfied, 0.01)
+
+    def test_wait_until_satisfied_woken_by_call(self):
+        mock = pmock.ThreadSafeMock()
+        mock.expects(pmock.once()).method("wolf")
+        caller = threading.Timer(0.01, mock.wolf)
+        caller.start()
+        mock.wait_until_satisfied(10)
+        caller.join()
+
+    def test_wait_until_invoked_woken_by_call(self):
+        mock = pmock.ThreadSafeMock()
+        builder = mock.stubs().method("wolf")
+        caller = threading.Timer(0.01, mock.wolf)
+        caller.start()
+        start = time.time()
+        mock.wait_until_invoked(builder, 10)
+        self.assert_(time.time() - start < 5)
+        caller.join()
+
+    def test_wait_until_invoked_times_out_before_invoked(self):
+        mock = pmock.ThreadSafeMock()
+        builder = mock.stubs().method("wolf")
+        try:
+            mock.wait_until_invoked(builder, 0.01)
+            self.fail("expected wait_until_invoked to raise")
+        except pmock.VerificationError, err:
+            self.assertEqual(err.msg, "expected method was not invoked: %s" %
+                             builder._mocker)
+
+    def test_wait_until_invoked_times_out_before_satisfied(self):
+        mock = pmock.ThreadSafeMock()
+        builder = mock.expects(pmock.exactly(2)).method("wolf")
+        mock.wolf()
+        try:
+            mock.wait_until_invoked(builder, 0.01)
+            self.fail("expected wait_until_invoked to raise")
+        except pmock.VerificationError, err:
+            self.assert_(err.msg.startswith(
+                "expected method to be invoked exactly 2 times but was "
+                "invoked 1 time"))
+
+
+class LoadExpectationsTest(testsupport.ErrorMsgAssertsMixin,
+                           unittest.TestCase):
+
+    def setUp(self):
+        self.mock = pmock.Mock()
+
+    def load(self, text, format, **kwargs):
+        return pmock.load_expectations(self.mock, StringIO.StringIO(text),
+                                       format, **kwargs)
+
+    def test_json(self):
+        self.assertEqual(self.load('[{"method": "howl", "args": [1, "moon"], '
+                                   '"kwargs": {"loud": true}, '
+                                   '"returns": "owoo", "count": 1}]',
+                                   "json"), 1)
+        self.assertRaises(pmock.MatchError, self.mock.howl, 1, "moon")
+        self.assertEqual(self.mock.howl(1, "moon", loud=True), "owoo")
+        self.mock.verify()
+
+    def test_strings_loaded_as_str(self):
+        self.load('[{"method": "howl", "returns": ["moon", "\\u263e"]}]',
+                  "json")
+        self.assertEqual(map(type, self.mock.howl()), [str, unicode])
+
+    def test_json_lines(self):
+        self.assertEqual(self.load('{"method": "howl", "returns": 1}\n'
+                                   '\n'
+                                   '{"method": "bark", "count": 2}\n',
+                                   "jsonl"), 2)
+        self.assertEqual(self.mock.howl(), 1)
+        self.assertRaises(pmock.VerificationError, self.mock.verify)
+
+    def test_csv(self):
+        self.assertEqual(self.load('method,args,kwargs,returns,raises,count\n'
+                                   'howl,"[""moon""]",,7,,1\n'
+                                   'bark,,"{""at"": ""cat""}",,,\n',
+                                   "csv"), 2)
+        self.assertEqual(self.mock.howl("moon"), 7)
+        self.assert_(self.mock.bark(at="cat") is None)
+        self.mock.verify()
+
+    def test_raises(self):
+        self.load('[{"method": "howl", "raises": "ValueError: no moon"},'
+                  ' {"method": "bark", "raises": "Quiet"}]', "json",
+                  exception_types={"Quiet": RuntimeError})
+        try:
+            self.mock.howl()
+            self.fail("expected howl to raise")
+        except ValueError, err:
+            self.assertEqual(str(err), "no moon")
+        self.assertRaises(RuntimeError, self.mock.bark)
+
+    def test_stubs_without_count(self):
+        self.load('[{"method": "howl"}]', "json")
+        self.mock.verify()
+        self.mock.howl()
+        self.mock.howl()
+
+    def test_registers_method_name(self):
+        self.load('[{"method": "howl", "count": 1}]', "json")
+        self.mock.expects(pmock.once()).bark().after("howl")
+        self.assertRaises(pmock.MatchError, self.mock.bark)
+
+    def test_format_from_file_name(self):
+        source = StringIO.StringIO('[{"method": "howl"}]')
+        source.name = "wolf.JSON"
+        self.assertEqual(pmock.load_expectations(self.mock, source), 1)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, self.load, '[]', "xml")
+        self.assertRaises(ValueError, self.load, '[]', None)
+
+    def test_invalid_rows(self):
+        for text, msg in [
+            ('[{"args": []}]', "row 1 of expectations has no method"),
+            ('[{"method": "howl"}, []]',
+             "row 2 of expectations isn't an object"),
+            ('[{"method": "howl", "returns": 1, "raises": "ValueError"}]',
+             "row 1 of expectations both returns and raises"),
+            ('[{"method": "howl", "raises": "Hoarse"}]',
+             "row 1 of expectations raises unknown exception type: Hoarse"),
+            ('{"method": "howl"}',
+             "expectations must be a JSON list of rows"),
+            ('[{"method": 5}]', "row 1 of expectations method isn't a string"),
+            ('[{"method": "howl", "args": "ab"}]',
+             "row 1 of expectations args isn't a list"),
+            ('[{"method": "howl", "kwargs": [1]}]',
+             "row 1 of expectations kwargs isn't an object"),
+            ('[{"method": "howl", "raises": 5}]',
+             "row 1 of expectations raises isn't a string"),
+            ('[{"method": "howl", "count": "2"}]',
+             "row 1 of expectations count isn't a non-negative integer"),
+            ('[{"method": "howl", "count": 1.5}]',
+             "row 1 of expectations count isn't a non-negative integer"),
+            ('[{"method": "howl", "count": -1}]',
+             "row 1 of expectations count isn't a non-negative integer"),
+            ('[{"method": "howl", "count": true}]',
+             "row 1 of expectations count isn't a non-negative integer"),
+            ('[{"method": "howl", "return": 5, "cont": 1}]',
+             "row 1 of expectations has unknown fields: cont, return")]:
+            try:
+                self.load(text, "json")
+                self.fail("expected invalid row to raise")
+            except pmock.DefinitionError, err:
+                self.assertEqual(err.msg, msg)
+
+    def test_unparsable_rows(self):
+        for text, format, msg in [
+            ('[{"method": ', "json", "expectations aren't valid JSON: "),
+            ('{"method": "howl"}\n{"method": \n', "jsonl",
+             "row 2 of expectations isn't valid JSON: "),
+            ('method,count\nhowl,1\nbark,two\n', "csv",
+             "row 2 of expectations has invalid count: "),
+            ('method,args\nhowl,[1\n', "csv",
+             "row 1 of expectations has invalid args: ")]:
+            try:
+                self.load(text, format)
+                self.fail("expected unparsable row to raise")
+            except pmock.DefinitionError, err:
+                self.assert_(err.msg.startswith(msg), err.msg)
+
+    def test_frozen_mock(self):
+        self.mock.freeze()
+        self.assertRaises(pmock.DefinitionError, self.load,
+                          '[{"method": "howl"}]', "json")
+
 
 class MockSpecialsTest(unittest.TestCase):
 
@@ -778,6 +2070,56 @@ class MockTestCaseTest(unittest.TestCase):
         self.assertEqual(len(result.failures), 1)
         self.assertEqual(len(result.errors), 0)
 
+    def test_freeze_mocks_on_invoke(self):
+        created_mocks = []
+        class Test(pmock.MockTestCase):
+            freeze_mocks = True
+            def test_method(self):
+                mock = self.mock()
+                mock.expects(pmock.once()).crow()
+                mock.crow()
+                created_mocks.append(mock)
+        test = Test('test_method')
+        result = unittest.TestResult()
+        test(result)
+        self.assert_(result.wasSuccessful())
+        self.assertRaises(pmock.DefinitionError, created_mocks[0].stubs)
+
+    def test_mock_dispatcher(self):
+        class Dispatcher:
+            def add(self, invokable): pass
+        created_mocks = []
+        class Test(pmock.MockTestCase):
+            def test_method(self):
+                created_mocks.append(self.mock(Dispatcher()))
+        Test('test_method')()
+        self.assert_(isinstance(created_mocks[0]._dispatcher, Dispatcher))
+
+    def test_thread_safe_mock(self):
+        created_mocks = []
+        class Test(pmock.MockTestCase):
+            def test_method(self):
+                created_mocks.append(self.mock())
+                created_mocks.append(self.mock(thread_safe=True))
+        Test('test_method')()
+        self.assert_(not isinstance(created_mocks[0], pmock.ThreadSafeMock))
+        self.assert_(isinstance(created_mocks[1], pmock.ThreadSafeMock))
+
+    def test_virtual_clock_reset_for_each_test(self):
+        times = []
+        class Test(pmock.MockTestCase):
+            def test_method(self):
+                times.append(pmock.virtual_clock().time())
+                pmock.virtual_clock().install()
+                time.sleep(10)
+        real_time = time.time
+        Test('test_method')()
+        Test('test_method')()
+        self.assertEqual(times, [0.0, 0.0])
+        self.assert_(time.time is real_time)
+        self.assertEqual(pmock.virtual_clock().time(), 10)
+        pmock.virtual_clock().reset()
+
     def test_auto_verify_order(self):
         events = []
         class MockMatcher:
@@ -831,6 +2173,132 @@ class RaiseExceptionStub(unittest.TestCase):
         self.assertEqual(str(self.stub), "raises %s" % self.exception)
 
 
+class LookupStubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.table = {"owl": "hoot", ("owl", 2): "hoot hoot"}
+
+    def test_invoke_returns_table_value(self):
+        stub = pmock.LookupStub(self.table)
+        self.assertEqual(stub.invoke(pmock.Invocation("call", ("owl",), {})),
+                         "hoot")
+        self.assertEqual(
+            stub.invoke(pmock.Invocation("call", ("owl", 2), {})),
+            "hoot hoot")
+
+    def test_missing_key_raises(self):
+        stub = pmock.LookupStub(self.table)
+        for args, kwargs in [(("crow",), {}), ((["owl"],), {}),
+                             (("owl",), {"loud": True})]:
+            self.assertRaises(AssertionError, stub.invoke,
+                              pmock.Invocation("call", args, kwargs))
+
+    def test_tuple_argument_not_taken_for_arguments(self):
+        stub = pmock.LookupStub(self.table, None)
+        self.assert_(stub.invoke(
+            pmock.Invocation("call", (("owl", 2),), {})) is None)
+        self.table[(("owl", 2),)] = "owl pair"
+        self.assertEqual(
+            stub.invoke(pmock.Invocation("call", (("owl", 2),), {})),
+            "owl pair")
+        self.assertEqual(
+            stub.invoke(pmock.Invocation("call", ("owl", 2), {})),
+            "hoot hoot")
+
+    def test_missing_key_returns_default(self):
+        stub = pmock.LookupStub(self.table, None)
+        self.assert_(
+            stub.invoke(pmock.Invocation("call", ("crow",), {})) is None)
+
+    def test_str(self):
+        self.assertEqual(str(pmock.lookup(self.table)),
+                         "looks up table of 2 entries")
+        self.assertEqual(str(pmock.lookup({"owl": "hoot"})),
+                         "looks up table of 1 entry")
+        self.assertEqual(str(pmock.lookup(self.table, "quiet")),
+                         "looks up table of 2 entries, default 'quiet'")
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    def test_sleep_advances_time(self):
+        clock = pmock.VirtualClock(100.0)
+        self.assertEqual(clock.time(), 100.0)
+        clock.sleep(2.5)
+        self.assertEqual(clock.time(), 102.5)
+
+    def test_negative_sleep_raises(self):
+        self.assertRaises(ValueError, pmock.VirtualClock().sleep, -1)
+
+    def test_install(self):
+        class TimeModule:
+            def time(self): return "real time"
+            def sleep(self, seconds): return "real sleep"
+        module = TimeModule()
+        clock = pmock.VirtualClock()
+        clock.install(module)
+        module.sleep(3)
+        self.assertEqual(module.time(), 3)
+        clock.uninstall()
+        self.assertEqual(module.time(), "real time")
+        self.assertEqual(module.sleep(3), "real sleep")
+
+    def test_install_in_time_module_by_default(self):
+        real_time = time.time
+        clock = pmock.VirtualClock()
+        clock.install()
+        try:
+            time.sleep(60)
+            self.assertEqual(time.time(), 60)
+        finally:
+            clock.uninstall()
+        self.assert_(time.time is real_time)
+
+    def test_uninstall_when_not_installed(self):
+        pmock.VirtualClock().uninstall()
+
+    def test_reset(self):
+        class TimeModule:
+            def time(self): return "real time"
+            def sleep(self, seconds): pass
+        module = TimeModule()
+        clock = pmock.VirtualClock(100.0)
+        clock.install(module)
+        clock.sleep(5)
+        clock.reset()
+        self.assertEqual(clock.time(), 100.0)
+        self.assertEqual(module.time(), "real time")
+
+    def test_shared_clock(self):
+        self.assert_(pmock.virtual_clock() is pmock.virtual_clock())
+
+
+class DelayStubTest(unittest.TestCase):
+
+    def test_invoke_sleeps_then_invokes_stub(self):
+        clock = pmock.VirtualClock()
+        stub = pmock.DelayStub(0.5, pmock.return_value("owl"), clock)
+        self.assertEqual(stub.invoke(pmock.Invocation("hoot", (), {})),
+                         "owl")
+        self.assertEqual(clock.time(), 0.5)
+
+    def test_invoke_without_stub(self):
+        clock = pmock.VirtualClock()
+        stub = pmock.DelayStub(0.5, clock=clock)
+        self.assert_(stub.invoke(pmock.Invocation("hoot", (), {})) is None)
+        self.assertEqual(clock.time(), 0.5)
+
+    def test_shared_clock_by_default(self):
+        start = pmock.virtual_clock().time()
+        pmock.delay(2).invoke(pmock.Invocation("hoot", (), {}))
+        self.assertEqual(pmock.virtual_clock().time(), start + 2)
+
+    def test_str(self):
+        self.assertEqual(str(pmock.delay(0.5)), "delays 0.5 seconds")
+        self.assertEqual(str(pmock.delay(0.5, pmock.return_value("owl"))),
+                         "returns 'owl' after 0.5 seconds")
+
+
 ##############################################################################
 # Invocation matchers
 ############################################################################## 
@@ -867,6 +2335,26 @@ class OnceInvocationMatcherTest(unittest.TestCase):
         self.assertEqual(str(self.matcher),
                          "expected once and has been invoked")
 
+    def test_subclass_can_add_attributes(self):
+        class CountingMatcher(pmock.OnceInvocationMatcher):
+            def invoked(self, invocation):
+                self.count = 1
+                pmock.OnceInvocationMatcher.invoked(self, invocation)
+        matcher = CountingMatcher()
+        matcher.invoked(pmock.Invocation("worm", (), {}))
+        self.assertEqual(matcher.count, 1)
+        self.assert_(matcher.has_been_invoked())
+
+    def test_exhausted_once_invoked(self):
+        self.assert_(not self.matcher.is_exhausted())
+        self.matcher.invoked(pmock.Invocation("worm", (), {}))
+        self.assert_(self.matcher.is_exhausted())
+
+    def test_satisfied_once_invoked(self):
+        self.assert_(not self.matcher.is_satisfied())
+        self.matcher.invoked(pmock.Invocation("worm", (), {}))
+        self.assert_(self.matcher.is_satisfied())
+
 
 class AtLeastOnceInvocationMatcherTest(unittest.TestCase):
 
@@ -899,6 +2387,95 @@ class AtLeastOnceInvocationMatcherTest(unittest.TestCase):
         self.assertEqual(str(self.matcher),
                          "expected at least once and has been invoked")
 
+    def test_never_exhausted(self):
+        self.matcher.invoked(pmock.Invocation("worm", (), {}))
+        self.assert_(not self.matcher.is_exhausted())
+
+    def test_satisfied_once_invoked(self):
+        self.assert_(not self.matcher.is_satisfied())
+        self.matcher.invoked(pmock.Invocation("worm", (), {}))
+        self.assert_(self.matcher.is_satisfied())
+
+
+class CountInvocationMatcherTest(unittest.TestCase):
+
+    def invoke(self, matcher, count):
+        for i in range(count):
+            self.assert_(matcher.matches(pmock.Invocation("worm", (), {})))
+            matcher.invoked(pmock.Invocation("worm", (), {}))
+
+    def test_exactly(self):
+        matcher = pmock.exactly(3)
+        self.invoke(matcher, 2)
+        self.assert_(not matcher.is_satisfied())
+        self.assertRaises(AssertionError, matcher.verify)
+        self.invoke(matcher, 1)
+        self.assert_(matcher.is_satisfied())
+        self.assert_(matcher.is_exhausted())
+        self.assert_(not matcher.matches(pmock.Invocation("worm", (), {})))
+        matcher.verify()
+
+    def test_at_least(self):
+        matcher = pmock.at_least(2)
+        self.invoke(matcher, 1)
+        self.assertRaises(AssertionError, matcher.verify)
+        self.invoke(matcher, 10)
+        self.assert_(not matcher.is_exhausted())
+        matcher.verify()
+
+    def test_at_most(self):
+        matcher = pmock.at_most(2)
+        matcher.verify()
+        self.invoke(matcher, 2)
+        self.assert_(matcher.is_exhausted())
+        self.assert_(not matcher.matches(pmock.Invocation("worm", (), {})))
+        matcher.verify()
+
+    def test_between(self):
+        matcher = pmock.between(1, 2)
+        self.assertRaises(AssertionError, matcher.verify)
+        self.invoke(matcher, 1)
+        matcher.verify()
+        self.invoke(matcher, 1)
+        self.assert_(not matcher.matches(pmock.Invocation("worm", (), {})))
+
+    def test_overrun_raises_when_invoked(self):
+        matcher = pmock.at_most(1)
+        self.invoke(matcher, 1)
+        try:
+            matcher.invoked(pmock.Invocation("worm", (), {}))
+            self.fail("expected invoked to raise")
+        except AssertionError, err:
+            self.assertEqual(str(err),
+                             "expected method to be invoked at most 1 time")
+        self.assertEqual(matcher.get_invocation_count(), 1)
+
+    def test_verify_msg(self):
+        matcher = pmock.between(2, 4)
+        self.invoke(matcher, 1)
+        try:
+            matcher.verify()
+            self.fail("expected verify to raise")
+        except AssertionError, err:
+            self.assertEqual(str(err), "expected method to be invoked "
+                             "between 2 and 4 times but was invoked 1 time")
+
+    def test_str(self):
+        self.assertEqual(str(pmock.exactly(3)), "expected exactly 3 times")
+        self.assertEqual(str(pmock.at_least(1)), "expected at least 1 time")
+        self.assertEqual(str(pmock.at_most(2)), "expected at most 2 times")
+        self.assertEqual(str(pmock.between(2, 3)),
+                         "expected between 2 and 3 times")
+        matcher = pmock.exactly(3)
+        self.invoke(matcher, 2)
+        self.assertEqual(str(matcher),
+                         "expected exactly 3 times and has been invoked "
+                         "2 times")
+
+    def test_invalid_range(self):
+        self.assertRaises(pmock.DefinitionError, pmock.at_least, -1)
+        self.assertRaises(pmock.DefinitionError, pmock.between, 3, 2)
+
 
 class NotCalledInvocationMatcherTest(unittest.TestCase):
 